@@ -0,0 +1,129 @@
+"""
+Shared, pooled Telegram clients for the API process.
+
+One `telegram.Bot` per bot_id (created on first use, kept for the life of the
+process) and one raw `httpx.AsyncClient` for direct Bot API / file calls.
+Both keep HTTP/2 keep-alive pools, so admin-panel actions don't pay a TLS
+handshake each time. Started and closed by the FastAPI lifespan.
+"""
+import os
+import time
+import asyncio
+import logging
+import httpx
+from collections import OrderedDict
+from telegram import Bot
+from bot.metrics import InstrumentedHTTPXRequest, telegram_http_hooks
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_POOL_SIZE: int = int(os.getenv("TELEGRAM_POOL_SIZE", "20"))
+TELEGRAM_TIMEOUT: float = float(os.getenv("TELEGRAM_TIMEOUT", "8"))
+TELEGRAM_API = "https://api.telegram.org"
+# Bot username / first_name practically never change
+BOT_IDENTITY_TTL: float = float(os.getenv("BOT_IDENTITY_TTL", "21600"))
+# Telegram guarantees a getFile link for at least 1 hour; stay just under it
+FILE_PATH_TTL: float = float(os.getenv("FILE_PATH_TTL", "3300"))
+FILE_PATH_CACHE_SIZE = 10_000
+
+
+class TelegramClients:
+    """Per-bot `telegram.Bot` registry plus a shared raw HTTP client."""
+
+    def __init__(self):
+        self._bots: dict[str, Bot] = {}
+        self._lock = asyncio.Lock()
+        self._http: httpx.AsyncClient | None = None
+        # bot_id → (fetched_at, token, {"username", "first_name"})
+        self._identities: dict[str, tuple[float, str, dict]] = {}
+        # (bot_id, file_id) → (fetched_at, file_path), least recently used first
+        self._file_paths: OrderedDict[tuple[str, str], tuple[float, str]] = OrderedDict()
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                http2=True,
+                timeout=TELEGRAM_TIMEOUT,
+                event_hooks=telegram_http_hooks(),
+                limits=httpx.Limits(
+                    max_connections=TELEGRAM_POOL_SIZE * 2,
+                    max_keepalive_connections=TELEGRAM_POOL_SIZE,
+                ),
+            )
+        return self._http
+
+    async def start(self):
+        _ = self.http
+
+    async def get_bot(self, bot_id: str, token: str) -> Bot:
+        """Return the initialized Bot for bot_id, (re)creating it if the token changed."""
+        bot = self._bots.get(bot_id)
+        if bot is not None and bot.token == token:
+            return bot
+        async with self._lock:
+            bot = self._bots.get(bot_id)
+            if bot is not None and bot.token == token:
+                return bot
+            if bot is not None:
+                await self._shutdown_bot(bot_id, bot)
+            bot = Bot(token, request=InstrumentedHTTPXRequest(
+                bot_id,
+                connection_pool_size=TELEGRAM_POOL_SIZE,
+                read_timeout=TELEGRAM_TIMEOUT,
+                http_version="2",
+            ))
+            await bot.initialize()
+            self._bots[bot_id] = bot
+            return bot
+
+    async def get_identity(self, bot_id: str, token: str) -> dict | None:
+        """Cached getMe result; a stale entry is served if Telegram is unreachable."""
+        cached = self._identities.get(bot_id)
+        if cached and cached[1] == token and time.monotonic() - cached[0] < BOT_IDENTITY_TTL:
+            return cached[2]
+        try:
+            r = await self.http.get(f"{TELEGRAM_API}/bot{token}/getMe")
+            data = r.json().get("result")
+            if data:
+                identity = {"username": data.get("username"), "first_name": data.get("first_name")}
+                self._identities[bot_id] = (time.monotonic(), token, identity)
+                return identity
+        except Exception as e:
+            logger.warning(f"[{bot_id}] getMe failed: {e}")
+        return cached[2] if cached and cached[1] == token else None
+
+    async def get_file_path(self, bot_id: str, token: str, file_id: str) -> str | None:
+        """Resolve a file_id to its Telegram file_path, cached for FILE_PATH_TTL."""
+        key = (bot_id, file_id)
+        cached = self._file_paths.get(key)
+        if cached and time.monotonic() - cached[0] < FILE_PATH_TTL:
+            self._file_paths.move_to_end(key)
+            return cached[1]
+        r = await self.http.get(f"{TELEGRAM_API}/bot{token}/getFile", params={"file_id": file_id})
+        data = r.json()
+        if not data.get("ok"):
+            return None
+        file_path = data["result"]["file_path"]
+        self._file_paths[key] = (time.monotonic(), file_path)
+        self._file_paths.move_to_end(key)
+        while len(self._file_paths) > FILE_PATH_CACHE_SIZE:
+            self._file_paths.popitem(last=False)
+        return file_path
+
+    async def _shutdown_bot(self, bot_id: str, bot: Bot):
+        try:
+            await bot.shutdown()
+        except Exception as e:
+            logger.warning(f"[{bot_id}] Telegram client shutdown error: {e}")
+
+    async def stop(self):
+        for bot_id, bot in list(self._bots.items()):
+            await self._shutdown_bot(bot_id, bot)
+        self._bots.clear()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+telegram_clients = TelegramClients()
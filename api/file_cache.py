@@ -0,0 +1,166 @@
+"""
+Size-bounded on-disk LRU cache for payment screenshots (and their thumbnails).
+
+Files are stored flat under SCREENSHOT_CACHE_DIR, named by a hash of the cache
+key. Recency is the file's mtime (bumped on every hit), so the cache survives
+restarts: on start-up the directory is scanned to rebuild the index. When the
+total size exceeds the limit, least recently used files are deleted.
+"""
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+SCREENSHOT_CACHE_DIR: str = os.getenv("SCREENSHOT_CACHE_DIR", "/tmp/tg-screenshot-cache")
+SCREENSHOT_CACHE_MB: int = int(os.getenv("SCREENSHOT_CACHE_MB", "512"))
+THUMBNAIL_SIZE: int = int(os.getenv("THUMBNAIL_SIZE", "320"))
+
+
+def cache_name(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class DiskLRU:
+    """Files on disk keyed by string, evicted least-recently-used past `max_bytes`."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # name → (last_used, size)
+        self._index: dict[str, tuple[float, int]] = {}
+        self._total = 0
+        os.makedirs(root, exist_ok=True)
+        for entry in os.scandir(root):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                self._index[entry.name] = (st.st_mtime, st.st_size)
+                self._total += st.st_size
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def get(self, key: str) -> str | None:
+        """Path of a cached file (marking it recently used), or None."""
+        name = cache_name(key)
+        with self._lock:
+            if name not in self._index:
+                return None
+            now = time.time()
+            self._index[name] = (now, self._index[name][1])
+        path = self._path(name)
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            self._forget(name)
+            return None
+        return path
+
+    def open(self, key: str) -> BinaryIO | None:
+        """A cached file opened for reading (marking it recently used), or None.
+
+        The handle stays readable even if the file is evicted afterwards.
+        """
+        path = self.get(key)
+        if not path:
+            return None
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            self._forget(cache_name(key))
+            return None
+
+    def create(self, key: str) -> tuple[BinaryIO, str]:
+        """(handle, temp path) to write a new entry into; finish with commit() or discard()."""
+        tmp = f"{self._path(cache_name(key))}.{uuid.uuid4().hex}.tmp"
+        return open(tmp, "w+b"), tmp
+
+    def commit(self, key: str, tmp: str, f: BinaryIO) -> str:
+        """Move a written temp file into the cache; `f` is rewound for reading."""
+        f.flush()
+        size = f.tell()
+        f.seek(0)
+        name = cache_name(key)
+        path = self._path(name)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._index.get(name)
+            self._total += size - (old[1] if old else 0)
+            self._index[name] = (time.time(), size)
+        self._evict()
+        return path
+
+    def discard(self, tmp: str, f: BinaryIO):
+        f.close()
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    def put(self, key: str, data: bytes) -> str:
+        """Store bytes under `key` and return the file path."""
+        f, tmp = self.create(key)
+        with f:
+            f.write(data)
+            return self.commit(key, tmp, f)
+
+    def _forget(self, name: str):
+        with self._lock:
+            old = self._index.pop(name, None)
+            if old:
+                self._total -= old[1]
+
+    def _evict(self):
+        with self._lock:
+            if self._total <= self.max_bytes:
+                return
+            victims = []
+            for name, (_, size) in sorted(self._index.items(), key=lambda kv: kv[1][0]):
+                if self._total <= self.max_bytes:
+                    break
+                victims.append(name)
+                self._total -= size
+            for name in victims:
+                del self._index[name]
+        for name in victims:
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+
+def sniff_image_type(data: bytes) -> str:
+    """Content type from magic bytes (screenshots are jpeg/png/webp/gif)."""
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def make_thumbnail(src: bytes | BinaryIO, size: int = THUMBNAIL_SIZE) -> bytes | None:
+    """JPEG thumbnail that fits in size×size, or None if Pillow is unavailable."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(BytesIO(src) if isinstance(src, bytes) else src) as img:
+            img.thumbnail((size, size))
+            out = BytesIO()
+            img.convert("RGB").save(out, format="JPEG", quality=80, optimize=True)
+            return out.getvalue()
+    except Exception as e:
+        logger.warning(f"Thumbnail generation failed: {e}")
+        return None
+
+
+screenshot_cache = DiskLRU(SCREENSHOT_CACHE_DIR, SCREENSHOT_CACHE_MB * 1024 * 1024)
@@ -1,31 +1,72 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel
-import os, datetime
-import httpx
+import os, re, datetime, hmac, asyncio, time, logging
 from supabase import create_client
 from dotenv import load_dotenv
-from telegram import Bot as TelegramBot
+from telegram import Update
+from bot.config import get_bot_config, get_config as _cached_config, set_config as _write_config
+from bot.db import get_stats, load_bot_configs, watch_config_versions
+from bot.admins import OWNER_IDS, extra_admin_ids
+from bot.payments import (
+    DECISIONS, decide_payment, decide_payments, announce_decision, announce_decisions,
+    PaymentAlreadyDecided, PaymentNotFound,
+)
+from api.clients import telegram_clients, TELEGRAM_API
+from bot.metrics import API_SECONDS, instrument_supabase, render_metrics
+from bot.main import (
+    BOT_MODE, WEBHOOK_APPS, start_webhook_bots, stop_webhook_bots, sync_webhook_bots,
+    watch_webhook_bots, webhook_secret,
+)
+from bot.supervisor import read_health
+from bot.registry import (
+    BOT_STATUSES, bot_registry, register_bot, set_bot_status, unregister_bot,
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_KEY = os.environ["SUPABASE_KEY"]
 API_SECRET   = os.getenv("API_SECRET", "changeme")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
+# Scrape credential for /metrics, so Prometheus need not hold the admin API key
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "") or API_SECRET
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase = instrument_supabase(create_client(SUPABASE_URL, SUPABASE_KEY))
 
-# Map BOT_ID → BOT_TOKEN from env
-# Set BOT_TOKEN_1, BOT_TOKEN_2, BOT_TOKEN_3 in your env
-BOT_TOKENS: dict[str, str] = {}
-for i in range(1, 6):  # support up to 5 bots
-    token = os.getenv(f"BOT_TOKEN_{i}", "")
-    bot_id = os.getenv(f"BOT_ID_{i}", f"bot{i}")
-    if token:
-        BOT_TOKENS[bot_id] = token
+# BOT_ID → BOT_TOKEN of every active bot: env BOT_TOKEN_<n> plus the `bots`
+# table, re-read every BOT_REGISTRY_TTL seconds (see bot/registry.py)
+BOT_TOKENS = bot_registry
 
-app = FastAPI(title="TG Bot Admin API — Multi-Bot")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await telegram_clients.start()
+    # BOT_TOKENS lookups never hit the DB; the registry is refreshed off-loop
+    try:
+        await asyncio.to_thread(bot_registry.refresh)
+    except Exception as e:
+        logger.error(f"Bot registry unavailable at start-up, retrying every {bot_registry.ttl}s: {e}")
+    # Webhook mode: every bot runs inside this process (see bot/main.py),
+    # and its reconcile loop refreshes the registry too
+    if BOT_MODE == "webhook":
+        await start_webhook_bots()
+        watcher = asyncio.create_task(watch_webhook_bots())
+    else:
+        watcher = asyncio.create_task(bot_registry.keep_fresh())
+    # Config written by the bot workers (e.g. /manage edits) reaches this cache too
+    config_watch = asyncio.create_task(watch_config_versions())
+    yield
+    config_watch.cancel()
+    watcher.cancel()
+    if BOT_MODE == "webhook":
+        await stop_webhook_bots()
+    await telegram_clients.stop()
+
+app = FastAPI(title="TG Bot Admin API — Multi-Bot", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +76,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (/bots/{bot_id}/...), not the concrete path
+        route = request.scope.get("route")
+        API_SECONDS.labels(request.method, getattr(route, "path", "unmatched"), str(status)).observe(
+            time.perf_counter() - start)
+
+def verify_metrics_token(authorization: str | None = Header(None),
+                         x_api_key: str | None = Header(None)):
+    # Prometheus sends `Authorization: Bearer <token>` (scrape config `authorization`)
+    scheme, _, token = (authorization or "").partition(" ")
+    supplied = token if scheme.lower() == "bearer" else (x_api_key or "")
+    if not hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+@app.get("/metrics", dependencies=[Depends(verify_metrics_token)])
+def metrics():
+    """Prometheus scrape endpoint (bot + API processes)."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/health")
 @app.head("/health")
 def health():
@@ -45,6 +114,21 @@ def root():
     return {"status": "ok", "bots": list(BOT_TOKENS.keys())}
 
 
+# ── Telegram webhook ──────────────────────────────────────────────────────────
+
+@app.post("/tg/{bot_id}/webhook")
+async def telegram_webhook(bot_id: str, request: Request,
+                           x_telegram_bot_api_secret_token: str = Header("")):
+    """Receive an update from Telegram and hand it to the bot's update_queue."""
+    tg_app = WEBHOOK_APPS.get(bot_id)
+    if not tg_app:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    if not hmac.compare_digest(x_telegram_bot_api_secret_token, webhook_secret(bot_id)):
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    data = await request.json()
+    await tg_app.update_queue.put(Update.de_json(data, tg_app.bot))
+    return {"ok": True}
+
 
 # ── Auth ──────────────────────────────────────────────────────────────────────
 
@@ -62,49 +146,121 @@ def verify_token(x_api_key: str = Header(...)):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 
+# ── Workers ───────────────────────────────────────────────────────────────────
+
+@app.get("/workers", dependencies=[Depends(verify_token)])
+def workers():
+    """Health of the bot supervisor's worker processes (polling mode)."""
+    report = read_health()
+    if report is None:
+        raise HTTPException(status_code=404, detail="No bot supervisor running")
+    return report
+
+
 # ── Bots ──────────────────────────────────────────────────────────────────────
 
 @app.get("/bots", dependencies=[Depends(verify_token)])
 async def list_bots():
     """Return list of configured bots with their Telegram username."""
+    tokens = dict(BOT_TOKENS)
+    bot_ids = list(tokens)
+    try:
+        configs = await load_bot_configs(bot_ids)
+    except Exception:
+        configs = {}
+    identities = await asyncio.gather(
+        *(telegram_clients.get_identity(bot_id, tokens[bot_id]) for bot_id in bot_ids)
+    )
+
     bots = []
-    async with httpx.AsyncClient(timeout=8) as client:
-        for bot_id, token in BOT_TOKENS.items():
-            name_override = _get_config_raw(bot_id, "bot_display_name", "")
-            try:
-                r = await client.get(f"https://api.telegram.org/bot{token}/getMe")
-                data = r.json().get("result", {})
-                bots.append({
-                    "bot_id": bot_id,
-                    "username": data.get("username", "unknown"),
-                    "first_name": data.get("first_name", "Bot"),
-                    "display_name": name_override or data.get("first_name", "Bot"),
-                })
-            except Exception:
-                bots.append({
-                    "bot_id": bot_id,
-                    "username": "unknown",
-                    "first_name": "Bot",
-                    "display_name": name_override or bot_id,
-                })
+    for bot_id, identity in zip(bot_ids, identities):
+        name_override = (configs.get(bot_id) or {}).get("bot_display_name", "")
+        if identity:
+            bots.append({
+                "bot_id": bot_id,
+                "username": identity.get("username") or "unknown",
+                "first_name": identity.get("first_name") or "Bot",
+                "display_name": name_override or identity.get("first_name") or "Bot",
+            })
+        else:
+            bots.append({
+                "bot_id": bot_id,
+                "username": "unknown",
+                "first_name": "Bot",
+                "display_name": name_override or bot_id,
+            })
     return bots
 
 
+# ── Bot registry ──────────────────────────────────────────────────────────────
+# Changes are picked up by the bot runner within BOT_REGISTRY_TTL seconds; in
+# webhook mode this process re-syncs its bots immediately.
+
+BOT_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
+class BotRegistration(BaseModel):
+    bot_id: str
+    token: str
+
+class BotStatusUpdate(BaseModel):
+    status: str  # "active" or "paused"
+
+async def _apply_registry_change():
+    if BOT_MODE == "webhook":
+        await sync_webhook_bots()
+
+@app.get("/registry/bots", dependencies=[Depends(verify_token)])
+async def registry_bots():
+    """Every known bot with its status (paused ones included) and source (env/table)."""
+    await asyncio.to_thread(bot_registry.refresh)
+    bots = bot_registry.bots()
+    return [{"bot_id": bot_id, **info} for bot_id, info in sorted(bots.items())]
+
+@app.post("/registry/bots", dependencies=[Depends(verify_token)])
+async def add_bot(body: BotRegistration):
+    """Add a bot (or replace its token). It starts without a redeploy."""
+    if not re.match(BOT_ID_PATTERN, body.bot_id):
+        raise HTTPException(status_code=400, detail="bot_id may only contain letters, digits, _ and -")
+    identity = await telegram_clients.get_identity(body.bot_id, body.token)
+    if not identity:
+        raise HTTPException(status_code=400, detail="Telegram rejected this token")
+    await asyncio.to_thread(register_bot, body.bot_id, body.token)
+    await _apply_registry_change()
+    return {"bot_id": body.bot_id, "status": "active", "username": identity.get("username")}
+
+@app.patch("/registry/bots/{bot_id}", dependencies=[Depends(verify_token)])
+async def update_bot_status(bot_id: str, body: BotStatusUpdate):
+    """Pause or resume a bot."""
+    if body.status not in BOT_STATUSES:
+        raise HTTPException(status_code=400, detail="status must be active or paused")
+    await asyncio.to_thread(bot_registry.refresh)
+    if bot_id not in bot_registry.bots():
+        raise HTTPException(status_code=404, detail="Bot not found")
+    await asyncio.to_thread(set_bot_status, bot_id, body.status)
+    await _apply_registry_change()
+    return {"bot_id": bot_id, "status": body.status}
+
+@app.delete("/registry/bots/{bot_id}", dependencies=[Depends(verify_token)])
+async def remove_bot(bot_id: str):
+    """Remove a bot added through the registry (env-defined bots can only be paused)."""
+    await asyncio.to_thread(bot_registry.refresh)
+    bots = bot_registry.bots()
+    if bot_id not in bots:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    if bots[bot_id]["source"] == "env":
+        raise HTTPException(status_code=400, detail="Bot is defined in env; pause it instead")
+    await asyncio.to_thread(unregister_bot, bot_id)
+    await _apply_registry_change()
+    return {"bot_id": bot_id, "removed": True}
+
+
 # ── Config helpers ────────────────────────────────────────────────────────────
 
 def _get_config_raw(bot_id: str, key: str, default=""):
-    try:
-        res = (supabase.table("bot_config")
-               .select("value").eq("bot_id", bot_id).eq("key", key)
-               .single().execute())
-        return res.data["value"] if res.data else default
-    except Exception:
-        return default
+    return _cached_config(key, bot_id, default)
 
 def _set_config_raw(bot_id: str, key: str, value: str):
-    supabase.table("bot_config").upsert(
-        {"bot_id": bot_id, "key": key, "value": value}
-    ).execute()
+    _write_config(key, value, bot_id)
 
 
 # ── Config endpoints ──────────────────────────────────────────────────────────
@@ -116,9 +272,7 @@ class ConfigUpdate(BaseModel):
 def get_all_config(bot_id: str):
     if bot_id not in BOT_TOKENS:
         raise HTTPException(status_code=404, detail="Bot not found")
-    res = (supabase.table("bot_config").select("key, value")
-           .eq("bot_id", bot_id).execute())
-    return {row["key"]: row["value"] for row in (res.data or [])}
+    return dict(get_bot_config(bot_id))
 
 @app.get("/bots/{bot_id}/config/{key}", dependencies=[Depends(verify_token)])
 def get_config(bot_id: str, key: str):
@@ -134,6 +288,26 @@ def update_config(bot_id: str, key: str, body: ConfigUpdate):
     return {"key": key, "value": body.value}
 
 
+# ── Admins ────────────────────────────────────────────────────────────────────
+
+@app.get("/bots/{bot_id}/admins", dependencies=[Depends(verify_token)])
+async def bot_admins(bot_id: str):
+    """Owners (ADMIN_TELEGRAM_ID) and extra admins for a bot."""
+    if bot_id not in BOT_TOKENS:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    return {"owners": sorted(OWNER_IDS), "extra_admins": await extra_admin_ids(bot_id)}
+
+
+# ── Stats ─────────────────────────────────────────────────────────────────────
+
+@app.get("/bots/{bot_id}/stats", dependencies=[Depends(verify_token)])
+async def bot_stats(bot_id: str):
+    """User and payment counts, aggregated in Postgres (constant-size response)."""
+    if bot_id not in BOT_TOKENS:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    return await get_stats(bot_id)
+
+
 # ── Image Upload ───────────────────────────────────────────────────────────────
 
 from fastapi import UploadFile, File
@@ -167,85 +341,447 @@ async def upload_image(bot_id: str, file: UploadFile = File(...)):
 
 
 # ── Telegram File URL (for payment screenshots) ────────────────────────────────
+# The browser never sees api.telegram.org/file/bot<token>/... URLs. File
+# endpoints hand out signed links to /bots/{bot_id}/screenshot/{file_id}, which
+# streams each screenshot once into an on-disk LRU and streams it (or a
+# thumbnail) back from there with ETag / Cache-Control headers, so a file is
+# never held in memory whole.
+
+import io, hashlib
+from typing import BinaryIO
+from fastapi.responses import StreamingResponse
+from api.file_cache import screenshot_cache, cache_name, make_thumbnail, sniff_image_type
+
+FILE_BATCH_LIMIT = 200
+FILE_BATCH_CONCURRENCY = 10
+MAX_TELEGRAM_FILE_BYTES = 20 * 1024 * 1024   # Bot API download limit
+SCREENSHOT_CHUNK = 64 * 1024
+SCREENSHOT_URL_TTL = 24 * 3600
+PUBLIC_API_URL = os.getenv("PUBLIC_API_URL", "").rstrip("/")
+
+# full-size cache key → [lock, requests holding or waiting for it]
+_download_locks: dict[str, list] = {}
+
+
+def _sign_screenshot(bot_id: str, file_id: str, size: str, expires: int) -> str:
+    msg = f"{bot_id}:{file_id}:{size}:{expires}".encode()
+    return hmac.new(API_SECRET.encode(), msg, hashlib.sha256).hexdigest()
+
+
+def _screenshot_url(request: Request, bot_id: str, file_id: str, size: str) -> str:
+    # Expiry rounded to the hour so the URL (the browser's cache key) stays stable
+    expires = (int(time.time()) + SCREENSHOT_URL_TTL) // 3600 * 3600
+    sig = _sign_screenshot(bot_id, file_id, size, expires)
+    base = PUBLIC_API_URL or str(request.base_url).rstrip("/")
+    return f"{base}/bots/{bot_id}/screenshot/{file_id}?size={size}&expires={expires}&sig={sig}"
+
+
+async def _download_telegram_file(bot_id: str, token: str, file_id: str, key: str) -> BinaryIO:
+    """Stream a Telegram file into the cache under `key`; returns it opened for reading."""
+    file_path = await telegram_clients.get_file_path(bot_id, token, file_id)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found on Telegram")
+    f, tmp = await asyncio.to_thread(screenshot_cache.create, key)
+    try:
+        total = 0
+        async with telegram_clients.http.stream("GET", f"{TELEGRAM_API}/file/bot{token}/{file_path}") as r:
+            if r.status_code != 200:
+                raise HTTPException(status_code=502, detail="Telegram file download failed")
+            async for chunk in r.aiter_bytes():
+                total += len(chunk)
+                if total > MAX_TELEGRAM_FILE_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large")
+                await asyncio.to_thread(f.write, chunk)
+        await asyncio.to_thread(screenshot_cache.commit, key, tmp, f)
+        return f
+    except BaseException:
+        await asyncio.to_thread(screenshot_cache.discard, tmp, f)
+        raise
+
+
+async def _cached_screenshot(bot_id: str, token: str, file_id: str, size: str) -> BinaryIO:
+    """The cached image, opened for reading (downloading / thumbnailing it on first use).
+
+    An open handle rather than a path: the file may be evicted by another
+    request's put() before it is served, and the handle keeps it readable.
+    """
+    key = f"{bot_id}:{file_id}:{size}"
+    f = await asyncio.to_thread(screenshot_cache.open, key)
+    if f:
+        return f
+    full_key = f"{bot_id}:{file_id}:full"
+    entry = _download_locks.setdefault(full_key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            f = await asyncio.to_thread(screenshot_cache.open, key)
+            if f:
+                return f
+            full = await asyncio.to_thread(screenshot_cache.open, full_key)
+            if full is None:
+                full = await _download_telegram_file(bot_id, token, file_id, full_key)
+            if size == "full":
+                return full
+            thumb = await asyncio.to_thread(make_thumbnail, full)
+            if not thumb:
+                full.seek(0)
+                return full
+            full.close()
+            await asyncio.to_thread(screenshot_cache.put, key, thumb)
+            return io.BytesIO(thumb)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _download_locks.pop(full_key, None)
+
+
+def _peek(f: BinaryIO) -> tuple[bytes, int]:
+    """(first bytes, total size) of an open file, left rewound."""
+    head = f.read(12)
+    size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    return head, size
+
+
+async def _iter_file(f: BinaryIO):
+    try:
+        while chunk := await asyncio.to_thread(f.read, SCREENSHOT_CHUNK):
+            yield chunk
+    finally:
+        f.close()
+
 
 @app.get("/bots/{bot_id}/file/{file_id}", dependencies=[Depends(verify_token)])
-async def get_telegram_file_url(bot_id: str, file_id: str):
-    """Convert a Telegram file_id to a direct download URL."""
+async def get_telegram_file_url(bot_id: str, file_id: str, request: Request):
+    """Signed proxy URLs (full + thumbnail) for a Telegram file_id."""
+    token = BOT_TOKENS.get(bot_id, "")
+    if not token:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    if not await telegram_clients.get_file_path(bot_id, token, file_id):
+        raise HTTPException(status_code=400, detail="Could not fetch file from Telegram")
+    return {
+        "url": _screenshot_url(request, bot_id, file_id, "full"),
+        "thumb_url": _screenshot_url(request, bot_id, file_id, "thumb"),
+    }
+
+
+class FileBatch(BaseModel):
+    file_ids: list[str]
+
+@app.post("/bots/{bot_id}/files", dependencies=[Depends(verify_token)])
+async def get_telegram_file_urls(bot_id: str, body: FileBatch, request: Request):
+    """Resolve many file_ids at once. Unresolvable ids map to null."""
+    token = BOT_TOKENS.get(bot_id, "")
+    if not token:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    file_ids = list(dict.fromkeys(body.file_ids))
+    if len(file_ids) > FILE_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {FILE_BATCH_LIMIT} file_ids per request")
+
+    sem = asyncio.Semaphore(FILE_BATCH_CONCURRENCY)
+
+    async def _resolve(file_id: str) -> bool:
+        async with sem:
+            try:
+                return bool(await telegram_clients.get_file_path(bot_id, token, file_id))
+            except Exception:
+                return False
+
+    found = await asyncio.gather(*(_resolve(f) for f in file_ids))
+    return {
+        "urls": {f: _screenshot_url(request, bot_id, f, "full") if ok else None
+                 for f, ok in zip(file_ids, found)},
+        "thumb_urls": {f: _screenshot_url(request, bot_id, f, "thumb") if ok else None
+                       for f, ok in zip(file_ids, found)},
+    }
+
+
+@app.get("/bots/{bot_id}/screenshot/{file_id}")
+async def screenshot_image(bot_id: str, file_id: str, size: str = "full",
+                           expires: int = 0, sig: str = "",
+                           x_api_key: str | None = Header(None),
+                           if_none_match: str | None = Header(None)):
+    """Serve a payment screenshot from the disk cache. Auth: X-API-Key or a signed URL."""
+    if size not in ("full", "thumb"):
+        raise HTTPException(status_code=400, detail="size must be full or thumb")
+    signed = expires >= time.time() and hmac.compare_digest(
+        sig, _sign_screenshot(bot_id, file_id, size, expires))
+    if not signed and x_api_key != API_SECRET:
+        raise HTTPException(status_code=401, detail="Unauthorized")
     token = BOT_TOKENS.get(bot_id, "")
     if not token:
         raise HTTPException(status_code=404, detail="Bot not found")
-    async with httpx.AsyncClient(timeout=8) as client:
-        r = await client.get(
-            f"https://api.telegram.org/bot{token}/getFile",
-            params={"file_id": file_id}
-        )
-        data = r.json()
-        if not data.get("ok"):
-            raise HTTPException(status_code=400, detail="Could not fetch file from Telegram")
-        file_path = data["result"]["file_path"]
-        url = f"https://api.telegram.org/file/bot{token}/{file_path}"
-        return {"url": url}
+
+    # Telegram files behind a file_id never change, so the ETag is just the key
+    headers = {
+        "ETag": f'"{cache_name(f"{bot_id}:{file_id}:{size}")[:32]}"',
+        "Cache-Control": "private, max-age=86400, immutable",
+    }
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    f = await _cached_screenshot(bot_id, token, file_id, size)
+    head, length = await asyncio.to_thread(_peek, f)
+    return StreamingResponse(_iter_file(f), media_type=sniff_image_type(head),
+                             headers={**headers, "Content-Length": str(length)})
 
 
 
 # ── Payments endpoints ────────────────────────────────────────────────────────
 
+# Both listings are keyset-paginated on (created_at, id), newest first. The
+# cursor is opaque to clients: pass `next_cursor` back to get the next page.
+
+import base64
+
+PAYMENT_COLUMNS = frozenset({
+    "id", "bot_id", "user_id", "username", "payment_type",
+    "screenshot_file_id", "status", "created_at", "updated_at", "admin_messages",
+})
+PAYMENTS_PAGE_DEFAULT = 50
+PAYMENTS_PAGE_MAX = 500
+
+
+def _encode_cursor(row: dict) -> str:
+    raw = f"{row['created_at']}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|", 1)
+        datetime.datetime.fromisoformat(created_at)
+        return created_at, str(uuid.UUID(row_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _check_timestamp(value: str | None, name: str):
+    if value is None:
+        return
+    try:
+        datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 timestamp")
+
+
+def _parse_fields(fields: str | None) -> str:
+    if not fields:
+        return "*"
+    cols = [c.strip() for c in fields.split(",") if c.strip()]
+    unknown = [c for c in cols if c not in PAYMENT_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # The cursor needs both sort keys
+    return ",".join(dict.fromkeys(cols + ["created_at", "id"]))
+
+
+def _payments_page(bot_id: str | None, cursor: str | None, limit: int, status: str | None,
+                   payment_type: str | None, user_id: int | None, since: str | None,
+                   until: str | None, fields: str | None, include_total: bool) -> dict:
+    limit = max(1, min(limit, PAYMENTS_PAGE_MAX))
+    _check_timestamp(since, "since")
+    _check_timestamp(until, "until")
+    q = supabase.table("payments").select(
+        _parse_fields(fields), count="exact" if include_total else None)
+    if bot_id:
+        q = q.eq("bot_id", bot_id)
+    if status:
+        q = q.eq("status", status)
+    if payment_type:
+        q = q.eq("payment_type", payment_type)
+    if user_id is not None:
+        q = q.eq("user_id", user_id)
+    if since:
+        q = q.gte("created_at", since)
+    if until:
+        q = q.lt("created_at", until)
+    if cursor:
+        created_at, row_id = _decode_cursor(cursor)
+        q = q.or_(f'created_at.lt."{created_at}",'
+                  f'and(created_at.eq."{created_at}",id.lt.{row_id})')
+    res = (q.order("created_at", desc=True).order("id", desc=True)
+           .limit(limit + 1).execute())
+    rows = res.data or []
+    items = rows[:limit]
+    page = {
+        "items": items,
+        "next_cursor": _encode_cursor(items[-1]) if len(rows) > limit else None,
+    }
+    if include_total:
+        page["total"] = res.count
+    return page
+
+
 @app.get("/payments", dependencies=[Depends(verify_token)])
-def get_all_payments():
-    """Get payments from ALL bots."""
-    res = (supabase.table("payments").select("*")
-           .order("created_at", desc=True).execute())
-    return res.data or []
+def get_all_payments(cursor: str | None = None, limit: int = PAYMENTS_PAGE_DEFAULT,
+                     status: str | None = None, payment_type: str | None = None,
+                     user_id: int | None = None, since: str | None = None,
+                     until: str | None = None, fields: str | None = None,
+                     include_total: bool = False):
+    """Page of payments from ALL bots."""
+    return _payments_page(None, cursor, limit, status, payment_type, user_id,
+                          since, until, fields, include_total)
 
 @app.get("/bots/{bot_id}/payments", dependencies=[Depends(verify_token)])
-def get_bot_payments(bot_id: str):
-    """Get payments for a specific bot."""
-    res = (supabase.table("payments").select("*")
-           .eq("bot_id", bot_id)
-           .order("created_at", desc=True).execute())
-    return res.data or []
+def get_bot_payments(bot_id: str, cursor: str | None = None, limit: int = PAYMENTS_PAGE_DEFAULT,
+                     status: str | None = None, payment_type: str | None = None,
+                     user_id: int | None = None, since: str | None = None,
+                     until: str | None = None, fields: str | None = None,
+                     include_total: bool = False):
+    """Page of payments for a specific bot."""
+    return _payments_page(bot_id, cursor, limit, status, payment_type, user_id,
+                          since, until, fields, include_total)
+
+# ── Exports ───────────────────────────────────────────────────────────────────
+# CSV / NDJSON streamed chunk by chunk from keyset-paginated reads, so memory
+# stays flat no matter how much history a bot has.
+
+import csv, json, itertools
+
+EXPORT_CHUNK = 1000
+EXPORT_PAYMENT_COLUMNS = ["id", "bot_id", "user_id", "username", "payment_type",
+                          "screenshot_file_id", "status", "created_at", "updated_at"]
+EXPORT_USER_COLUMNS = ["user_id", "username", "first_name", "is_active", "created_at", "updated_at"]
+
+
+def _iter_payment_rows(bot_id: str, fields: str | None, **filters):
+    cursor = None
+    while True:
+        page = _payments_page(bot_id, cursor, EXPORT_CHUNK, fields=fields,
+                              include_total=False, **filters)
+        yield page["items"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return
+
+
+def _iter_user_rows(bot_id: str):
+    after = None
+    while True:
+        q = (supabase.table("bot_users").select(",".join(EXPORT_USER_COLUMNS))
+             .eq("bot_id", bot_id))
+        if after is not None:
+            q = q.gt("user_id", after)
+        rows = q.order("user_id").limit(EXPORT_CHUNK).execute().data or []
+        if not rows:
+            return
+        yield rows
+        if len(rows) < EXPORT_CHUNK:
+            return
+        after = rows[-1]["user_id"]
+
+
+def _encode_chunks(chunks, columns: list[str], fmt: str):
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        yield buf.getvalue()
+    for rows in chunks:
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+            writer.writerows(rows)
+            yield buf.getvalue()
+        else:
+            yield "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in rows)
+
+
+def _export_response(chunks, columns: list[str], fmt: str, name: str) -> StreamingResponse:
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    # Fetch the first chunk now: once streaming starts the status is already
+    # 200, so a bad filter or a DB error must surface before that
+    first = next(chunks, None)
+    chunks = itertools.chain([first], chunks) if first is not None else iter(())
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return StreamingResponse(
+        _encode_chunks(chunks, columns, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}-{stamp}.{fmt}"'},
+    )
+
+
+@app.get("/bots/{bot_id}/export/payments", dependencies=[Depends(verify_token)])
+def export_payments(bot_id: str, format: str = "csv", status: str | None = None,
+                    payment_type: str | None = None, user_id: int | None = None,
+                    since: str | None = None, until: str | None = None,
+                    fields: str | None = None):
+    """Stream a bot's payments (newest first) as CSV or NDJSON."""
+    if bot_id not in BOT_TOKENS:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    columns = _parse_fields(fields).split(",") if fields else EXPORT_PAYMENT_COLUMNS
+    chunks = _iter_payment_rows(bot_id, ",".join(columns), status=status,
+                                payment_type=payment_type, user_id=user_id,
+                                since=since, until=until)
+    return _export_response(chunks, columns, format, f"{bot_id}-payments")
+
+
+@app.get("/bots/{bot_id}/export/users", dependencies=[Depends(verify_token)])
+def export_users(bot_id: str, format: str = "csv"):
+    """Stream a bot's users (by user_id) as CSV or NDJSON."""
+    if bot_id not in BOT_TOKENS:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    return _export_response(_iter_user_rows(bot_id), EXPORT_USER_COLUMNS, format, f"{bot_id}-users")
+
 
 class PaymentAction(BaseModel):
     status: str  # "confirmed" or "rejected"
 
 @app.patch("/payments/{payment_id}", dependencies=[Depends(verify_token)])
 async def update_payment(payment_id: str, body: PaymentAction):
-    if body.status not in ("confirmed", "rejected"):
+    """Approve/reject a pending payment. Repeating the same decision is a no-op;
+    a conflicting one (another admin got there first) is a 409."""
+    if body.status not in DECISIONS:
         raise HTTPException(status_code=400, detail="Invalid status")
-
-    res = (supabase.table("payments").select("*")
-           .eq("id", payment_id).single().execute())
-    if not res.data:
+    try:
+        payment, changed = await decide_payment(payment_id, body.status)
+    except PaymentNotFound:
         raise HTTPException(status_code=404, detail="Payment not found")
+    except PaymentAlreadyDecided as e:
+        raise HTTPException(status_code=409, detail=f"Payment already {e.payment['status']}")
 
-    payment = res.data
-    bot_id  = payment["bot_id"]
-    user_id = payment["user_id"]
-    token   = BOT_TOKENS.get(bot_id, "")
-
-    supabase.table("payments").update({
-        "status": body.status,
-        "updated_at": datetime.datetime.utcnow().isoformat(),
-    }).eq("id", payment_id).execute()
-
-    if token:
-        bot = TelegramBot(token=token)
+    token = BOT_TOKENS.get(payment["bot_id"], "")
+    if changed and token:
         try:
-            if body.status == "confirmed":
-                msg = _get_config_raw(
-                    bot_id, "payment_confirmed_message",
-                    "🎉 <b>Payment Confirmed!</b>\n\nYour premium access has been activated. Welcome! 🌟"
-                )
-            else:
-                msg = (
-                    "❌ <b>Payment Rejected</b>\n\n"
-                    "Unfortunately, we could not verify your payment screenshot.\n"
-                    "Please send a clear screenshot of the successful transaction.\n"
-                    "If you believe this is a mistake, contact support.\n"
-                    "Try again with /start. 🙏"
-                )
-            await bot.send_message(chat_id=user_id, text=msg, parse_mode="HTML")
+            bot = await telegram_clients.get_bot(payment["bot_id"], token)
+            await announce_decision(bot, payment)
         except Exception:
             pass
 
-    return {"id": payment_id, "status": body.status}
+    return {"id": payment_id, "status": payment["status"], "changed": changed}
+
+
+BULK_PAYMENT_LIMIT = 1000
+
+class BulkPaymentAction(BaseModel):
+    payment_ids: list[str]
+    status: str  # "confirmed" or "rejected"
+
+@app.post("/bots/{bot_id}/payments/bulk", dependencies=[Depends(verify_token)])
+async def bulk_update_payments(bot_id: str, body: BulkPaymentAction, background: BackgroundTasks):
+    """Approve/reject many pending payments in one set-based update.
+
+    Users are notified after the response, concurrently under the bot's rate
+    limits. IDs that were not pending (or belong to another bot) are skipped.
+    """
+    if body.status not in DECISIONS:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    if len(body.payment_ids) > BULK_PAYMENT_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_PAYMENT_LIMIT} payments per request")
+
+    moved = await decide_payments(body.payment_ids, body.status, bot_id)
+    token = BOT_TOKENS.get(bot_id, "")
+    if moved and token:
+        bot = await telegram_clients.get_bot(bot_id, token)
+        background.add_task(announce_decisions, bot, moved)
+
+    updated = {p["id"] for p in moved}
+    return {
+        "status": body.status,
+        "updated": [p["id"] for p in moved],
+        "skipped": [i for i in dict.fromkeys(body.payment_ids) if i not in updated],
+    }
@@ -0,0 +1,61 @@
+"""
+Per-bot admin registry.
+
+Owners come from ADMIN_TELEGRAM_ID and are parsed once at import. Extra admins
+live in the `extra_admins` config key; the parsed frozenset of owners + extras
+is memoised per bot against the raw config string, so authorization checks are
+an in-memory set lookup. Writes through add_admin / remove_admin (or any
+set_config of `extra_admins`) update the config cache, which the next lookup
+picks up.
+"""
+from bot.config import owner_ids
+from bot.db import get_config, set_extra_admin_ids, parse_ids
+
+OWNER_IDS: frozenset[int] = frozenset(owner_ids())
+
+# bot_id → (raw extra_admins value, owners | extras)
+_sets: dict[str, tuple[str, frozenset[int]]] = {}
+
+
+def is_owner(user_id: int) -> bool:
+    return user_id in OWNER_IDS
+
+
+def _resolve(bot_id: str, raw: str) -> frozenset[int]:
+    cached = _sets.get(bot_id)
+    if cached and cached[0] == raw:
+        return cached[1]
+    ids = OWNER_IDS | frozenset(parse_ids(raw))
+    _sets[bot_id] = (raw, ids)
+    return ids
+
+
+async def admin_ids(bot_id: str) -> frozenset[int]:
+    """Owners plus the bot's extra admins."""
+    return _resolve(bot_id, await get_config("extra_admins", bot_id, "") or "")
+
+
+async def extra_admin_ids(bot_id: str) -> list[int]:
+    """The bot's extra admins in the order they were added."""
+    return parse_ids(await get_config("extra_admins", bot_id, ""))
+
+
+async def is_admin(user_id: int, bot_id: str = "default") -> bool:
+    """Check primary admin OR extra admins for this bot."""
+    if user_id in OWNER_IDS:
+        return True
+    try:
+        return user_id in await admin_ids(bot_id)
+    except Exception:
+        return False
+
+
+async def add_admin(bot_id: str, user_id: int):
+    ids = await extra_admin_ids(bot_id)
+    if user_id not in ids:
+        await set_extra_admin_ids(bot_id, ids + [user_id])
+
+
+async def remove_admin(bot_id: str, user_id: int):
+    ids = await extra_admin_ids(bot_id)
+    await set_extra_admin_ids(bot_id, [i for i in ids if i != user_id])
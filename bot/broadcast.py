@@ -0,0 +1,403 @@
+"""
+Broadcast engine — rate-limited, concurrent, resumable.
+
+A broadcast is a row in `broadcast_jobs`. Recipients are streamed in ascending
+user_id order (a keyset walk of bot_users merged with payers and admins, so
+memory stays constant) and sent in batches; after every batch the counters and the cursor
+(`last_user_id`) are written back, so a job interrupted by a restart resumes
+from the last finished batch. Progress shown to the admin is rendered from
+that job record, not from per-message edits.
+
+Each running job is leased to one process (`owner` / `lease_until`, claimed
+atomically by the claim_broadcast_job RPC and renewed after every batch), so
+with several replicas a job is sent by exactly one of them; a job whose owner
+died is adopted once its lease expires.
+
+Sending respects Telegram's limits:
+  - a per-bot token bucket (BROADCAST_RATE msgs/sec, ~30/s is the hard cap)
+  - at most one message per chat per second
+  - RetryAfter pauses the whole bot's bucket for the requested time
+"""
+import os
+import time
+import asyncio
+import logging
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError, TimedOut
+from bot.admins import admin_ids
+from bot.db import (
+    iter_user_ids, get_stats,
+    create_broadcast_job, update_broadcast_job, list_running_broadcast_jobs,
+    claim_broadcast_job, release_broadcast_job,
+)
+from bot.leases import HOLDER_ID
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY: int = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BATCH_SIZE = 100
+PER_CHAT_INTERVAL = 1.0
+PROGRESS_INTERVAL = 5.0
+MAX_ATTEMPTS = 3
+# A job's owner must renew within this many seconds or another process adopts it
+JOB_LEASE_TTL: float = float(os.getenv("BROADCAST_LEASE_TTL", "60"))
+JOB_MAX_RETRIES = 5
+
+
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds` (Telegram flood control)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class RateLimiter:
+    """Global token bucket plus a minimum interval between sends to one chat."""
+
+    def __init__(self, rate: float = BROADCAST_RATE):
+        self.bucket = TokenBucket(rate)
+        self._next_per_chat: dict[int, float] = {}
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        start = max(now, self._next_per_chat.get(chat_id, 0.0))
+        self._next_per_chat[chat_id] = start + PER_CHAT_INTERVAL
+        if start > now:
+            await asyncio.sleep(start - now)
+        await self.bucket.acquire()
+        if len(self._next_per_chat) > 10_000:
+            now = time.monotonic()
+            self._next_per_chat = {c: t for c, t in self._next_per_chat.items() if t > now}
+
+
+# bot_id → limiter, shared by every job (and later bulk sends) of that bot
+_limiters: dict[str, RateLimiter] = {}
+
+
+def get_limiter(bot_id: str) -> RateLimiter:
+    if bot_id not in _limiters:
+        _limiters[bot_id] = RateLimiter()
+    return _limiters[bot_id]
+
+
+def _retry_seconds(err: RetryAfter) -> float:
+    delay = err.retry_after
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+async def send_limited(bot, limiter: RateLimiter, chat_id: int, **kwargs) -> str:
+    """
+    Send one message under the rate limiter.
+    Returns "sent", "blocked" (user blocked/deleted) or "failed".
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await limiter.acquire(chat_id)
+        try:
+            await bot.send_message(chat_id=chat_id, **kwargs)
+            return "sent"
+        except RetryAfter as e:
+            logger.warning(f"Flood control: pausing sends for {_retry_seconds(e)}s")
+            limiter.bucket.pause(_retry_seconds(e))
+        except Forbidden:
+            return "blocked"
+        except BadRequest as e:
+            err_str = str(e).lower()
+            if "not found" in err_str or "deactivated" in err_str or "blocked" in err_str:
+                return "blocked"
+            return "failed"
+        except (TimedOut, NetworkError):
+            await asyncio.sleep(attempt)
+        except Exception as e:
+            logger.warning(f"Send to {chat_id} failed: {e}")
+            return "failed"
+    return "failed"
+
+
+# ── Recipients ────────────────────────────────────────────────────────────────
+
+async def _iter_list(values):
+    for v in values:
+        yield v
+
+
+async def _merge_sorted(*streams):
+    """Merge ascending async streams into one ascending stream without duplicates."""
+    heads = []
+    for stream in streams:
+        try:
+            heads.append([await anext(stream), stream])
+        except StopAsyncIteration:
+            pass
+    last = None
+    while heads:
+        i = min(range(len(heads)), key=lambda k: heads[k][0])
+        value, stream = heads[i]
+        if value != last:
+            last = value
+            yield value
+        try:
+            heads[i][0] = await anext(stream)
+        except StopAsyncIteration:
+            heads.pop(i)
+
+
+async def iter_recipients(bot_id: str, after: int | None = None):
+    """
+    Everyone who used /start or paid, plus admins — as an ascending stream of
+    user_ids greater than `after`. Only one page per source is held in memory.
+    """
+    admins = await admin_ids(bot_id)
+    async for uid in _merge_sorted(
+        iter_user_ids("bot_users", bot_id, after),
+        iter_user_ids("payments", bot_id, after),
+        _iter_list(sorted(a for a in admins if after is None or a > after)),
+    ):
+        yield uid
+
+
+async def count_recipients(bot_id: str) -> int:
+    """Size of iter_recipients' stream, counted server-side."""
+    admins = await admin_ids(bot_id)
+    return (await get_stats(bot_id, admins))["audience"]
+
+
+# ── Jobs ──────────────────────────────────────────────────────────────────────
+
+# job_id → (bot_id, running task), so a job is never resumed twice in one process.
+# Plain loop tasks rather than Application.create_task: Application.stop() waits
+# for those, and a long broadcast must not hold up a bot restart.
+_active: dict[str, tuple[str, asyncio.Task]] = {}
+# bot_id → task that periodically picks up unowned / orphaned jobs
+_watchers: dict[str, asyncio.Task] = {}
+
+
+class JobLost(Exception):
+    """Another process took over the job's lease."""
+
+
+def _progress_text(job: dict) -> str:
+    done = job.get("sent", 0) + job.get("blocked", 0) + job.get("failed", 0)
+    total = job.get("total") or done
+    if job.get("status") == "done":
+        return (
+            f"📢 <b>Broadcast Completed Successfully! 🎉</b>\n\n"
+            f"👥 Total users: <b>{total}</b>\n"
+            f"✅ Delivered: <b>{job.get('sent', 0)}</b>\n"
+            f"🚫 Blocked/Inactive: <b>{job.get('blocked', 0)}</b>\n"
+            f"❌ Other failures: <b>{job.get('failed', 0)}</b>"
+        )
+    if job.get("status") == "failed":
+        return (
+            f"📢 <b>Broadcast Failed</b>\n\n"
+            f"✅ Sent before the failure: <b>{job.get('sent', 0)}</b> of <b>{total}</b>\n"
+            f"❌ {job.get('error') or 'unknown error'}"
+        )
+    return (
+        f"📢 <b>Broadcasting...</b>\n\n"
+        f"👥 Total: <b>{total}</b>\n"
+        f"✅ Sent: <b>{job.get('sent', 0)}</b>\n"
+        f"⏳ Remaining: <b>{max(total - done, 0)}</b>"
+    )
+
+
+async def _report_progress(bot, job: dict):
+    if not job.get("status_chat_id") or not job.get("status_message_id"):
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=job["status_chat_id"],
+            message_id=job["status_message_id"],
+            text=_progress_text(job),
+            parse_mode="HTML",
+        )
+    except Exception:
+        pass
+
+
+async def run_job(bot, job: dict):
+    """Send a job's message to every recipient after its cursor.
+
+    The caller must hold the job's lease; it is renewed after every batch.
+    A DB / Telegram error retries from the cursor with exponential backoff,
+    and after JOB_MAX_RETRIES failures in a row the job is marked failed.
+    """
+    bot_id = job["bot_id"]
+    limiter = get_limiter(bot_id)
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    last_report = time.monotonic()
+    retries = 0
+
+    async def _send(uid: int) -> str:
+        async with sem:
+            return await send_limited(bot, limiter, uid, text=job["text"], parse_mode="HTML")
+
+    async def _flush(batch: list[int]):
+        nonlocal last_report, retries
+        for result in await asyncio.gather(*(_send(uid) for uid in batch)):
+            job[result] = job.get(result, 0) + 1
+        job["last_user_id"] = batch[-1]
+        await update_broadcast_job(job["id"], {
+            k: job[k] for k in ("last_user_id", "sent", "blocked", "failed")
+        })
+        if not await claim_broadcast_job(job["id"], HOLDER_ID, JOB_LEASE_TTL):
+            raise JobLost()
+        retries = 0
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            await _report_progress(bot, job)
+            last_report = time.monotonic()
+
+    async def _run():
+        batch = []
+        async for uid in iter_recipients(bot_id, after=job.get("last_user_id")):
+            batch.append(uid)
+            if len(batch) >= BATCH_SIZE:
+                await _flush(batch)
+                batch = []
+        if batch:
+            await _flush(batch)
+
+    try:
+        while True:
+            try:
+                await _run()
+                break
+            except (JobLost, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                retries += 1
+                if retries > JOB_MAX_RETRIES:
+                    await _fail_job(bot, job, e)
+                    return
+                delay = min(2 ** retries, 60)
+                logger.warning(f"[{bot_id}] Broadcast {job['id']} error: {e} — "
+                               f"retry {retries}/{JOB_MAX_RETRIES} in {delay}s")
+                await asyncio.sleep(delay)
+                # The backoff can outlast the lease; keep it or stop if it moved on
+                try:
+                    if not await claim_broadcast_job(job["id"], HOLDER_ID, JOB_LEASE_TTL):
+                        raise JobLost()
+                except JobLost:
+                    raise
+                except Exception:
+                    pass
+
+        job["status"] = "done"
+        await update_broadcast_job(job["id"], {"status": "done"})
+        await _report_progress(bot, job)
+        logger.info(f"[{bot_id}] Broadcast {job['id']} done: {job.get('sent', 0)}/{job.get('total')} delivered")
+    except JobLost:
+        logger.warning(f"[{bot_id}] Broadcast {job['id']} was taken over by another process — stopping here")
+    except asyncio.CancelledError:
+        logger.info(f"[{bot_id}] Broadcast {job['id']} paused at user {job.get('last_user_id')}")
+        # Let another process (e.g. the next deploy) resume it without waiting for the lease
+        await asyncio.shield(_release(job))
+        raise
+    except Exception as e:
+        logger.error(f"[{bot_id}] Broadcast {job['id']} could not be finalised: {e}")
+    finally:
+        _active.pop(job["id"], None)
+
+
+async def _release(job: dict):
+    try:
+        await release_broadcast_job(job["id"], HOLDER_ID)
+    except Exception as e:
+        logger.warning(f"[{job['bot_id']}] Could not release broadcast {job['id']}: {e}")
+
+
+async def _fail_job(bot, job: dict, err: Exception):
+    logger.error(f"[{job['bot_id']}] Broadcast {job['id']} failed after {JOB_MAX_RETRIES} retries: {err}")
+    job["status"], job["error"] = "failed", str(err)[:500]
+    try:
+        await update_broadcast_job(job["id"], {"status": "failed", "error": job["error"]})
+    except Exception as e:
+        # Left running; its lease expires and a watcher retries it later
+        logger.error(f"[{job['bot_id']}] Could not mark broadcast {job['id']} failed: {e}")
+    await _report_progress(bot, job)
+
+
+def start_job(application, job: dict):
+    """Run a claimed job in the background, detached from the conversation."""
+    if job["id"] in _active:
+        return
+    _active[job["id"]] = (job["bot_id"], asyncio.create_task(run_job(application.bot, job)))
+
+
+async def create_job(application, bot_id: str, text: str, total: int,
+                     status_chat_id: int | None = None,
+                     status_message_id: int | None = None) -> dict:
+    job = await create_broadcast_job(bot_id, text, total, status_chat_id, status_message_id,
+                                     owner=HOLDER_ID, lease_ttl=JOB_LEASE_TTL)
+    start_job(application, job)
+    return job
+
+
+async def _claim_jobs(application, bot_id: str):
+    """Start every running job of the bot that no live process holds."""
+    try:
+        jobs = await list_running_broadcast_jobs(bot_id)
+    except Exception as e:
+        logger.warning(f"[{bot_id}] Could not load broadcast jobs: {e}")
+        return
+    for job in jobs:
+        if job["id"] in _active:
+            continue
+        try:
+            if not await claim_broadcast_job(job["id"], HOLDER_ID, JOB_LEASE_TTL):
+                continue  # another replica is sending it
+        except Exception as e:
+            logger.warning(f"[{bot_id}] Could not claim broadcast {job['id']}: {e}")
+            continue
+        logger.info(f"[{bot_id}] Resuming broadcast {job['id']} after user {job.get('last_user_id')}")
+        start_job(application, job)
+
+
+async def _watch_jobs(application, bot_id: str):
+    while True:
+        await asyncio.sleep(JOB_LEASE_TTL)
+        await _claim_jobs(application, bot_id)
+
+
+async def resume_jobs(application):
+    """Resume jobs left running by a previous process, and keep adopting
+    jobs whose owner died (lease expired) while this bot runs."""
+    bot_id = application.bot_data.get("bot_id", "default")
+    await _claim_jobs(application, bot_id)
+    if bot_id not in _watchers:
+        _watchers[bot_id] = asyncio.create_task(_watch_jobs(application, bot_id))
+
+
+async def stop_jobs(bot_id: str):
+    """Pause a bot's running jobs; their cursor lets resume_jobs pick them up."""
+    watcher = _watchers.pop(bot_id, None)
+    if watcher:
+        watcher.cancel()
+    tasks = [task for owner, task in list(_active.values()) if owner == bot_id]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
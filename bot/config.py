@@ -1,6 +1,10 @@
 import os
+import time
+import threading
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from bot.media import MEDIA_KEYS, forget_media
+from bot.metrics import instrument_supabase
 
 load_dotenv()
 
@@ -9,21 +13,95 @@ SUPABASE_KEY: str = os.environ["SUPABASE_KEY"]
 API_SECRET: str = os.getenv("API_SECRET", "changeme")
 ADMIN_PASSWORD: str = os.getenv("ADMIN_PASSWORD", "admin123")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Seconds a cached bot_config slice is trusted before it is re-read.
+# Writes through set_config invalidate this process's cache immediately;
+# writes by other processes (the API vs. the bot workers) are picked up by
+# polling bot_config_versions every CONFIG_POLL_INTERVAL seconds
+# (bot.db.watch_config_versions). The TTL is only the fallback.
+CONFIG_CACHE_TTL: float = float(os.getenv("CONFIG_CACHE_TTL", "60"))
+CONFIG_POLL_INTERVAL: float = float(os.getenv("CONFIG_POLL_INTERVAL", "2"))
+
+supabase: Client = instrument_supabase(create_client(SUPABASE_URL, SUPABASE_KEY))
+
+
+# ── Config cache ──────────────────────────────────────────────────────────────
+# bot_id → (loaded_at, {key: value}). One query loads a bot's whole slice.
+_config_cache: dict[str, tuple[float, dict[str, str]]] = {}
+_config_lock = threading.Lock()
+# bot_id → last seen bot_config_versions.version
+_config_versions: dict[str, int] = {}
+
+
+def cached_config_slice(bot_id: str) -> dict[str, str] | None:
+    """Return the cached config dict for a bot if it is still fresh."""
+    with _config_lock:
+        entry = _config_cache.get(bot_id)
+    if entry and time.monotonic() - entry[0] < CONFIG_CACHE_TTL:
+        return entry[1]
+    return None
+
+
+def store_config_slice(bot_id: str, rows: list[dict]) -> dict[str, str]:
+    """Replace the cached slice for a bot with freshly loaded rows."""
+    values = {row["key"]: row["value"] for row in rows}
+    with _config_lock:
+        _config_cache[bot_id] = (time.monotonic(), values)
+    return values
+
+
+def cache_config_value(key: str, value: str, bot_id: str = "default"):
+    """Write-through a single value into a cached slice (if one is loaded)."""
+    with _config_lock:
+        entry = _config_cache.get(bot_id)
+        old = entry[1].get(key) if entry else None
+        if entry:
+            entry[1][key] = value
+    if key in MEDIA_KEYS and old != value:
+        # Old value unknown (slice not cached) → drop all of the bot's file_ids
+        forget_media(bot_id, old)
+
+
+def invalidate_config(bot_id: str | None = None):
+    """Drop the cached slice for one bot, or for every bot."""
+    with _config_lock:
+        if bot_id is None:
+            _config_cache.clear()
+        else:
+            _config_cache.pop(bot_id, None)
+
+
+def apply_config_versions(rows: list[dict]) -> list[str]:
+    """Drop the cached slices whose bot_config version moved; returns their bot_ids."""
+    with _config_lock:
+        changed = [row["bot_id"] for row in rows
+                   if _config_versions.get(row["bot_id"]) != row["version"]]
+        for row in rows:
+            _config_versions[row["bot_id"]] = row["version"]
+    for bot_id in changed:
+        invalidate_config(bot_id)
+        # The old media URLs are unknown here
+        forget_media(bot_id)
+    return changed
+
+
+def get_bot_config(bot_id: str = "default") -> dict[str, str]:
+    """Return the whole config slice for a BOT_ID, loading it in one query."""
+    cached = cached_config_slice(bot_id)
+    if cached is not None:
+        return cached
+    res = (
+        supabase.table("bot_config")
+        .select("key, value")
+        .eq("bot_id", bot_id)
+        .execute()
+    )
+    return store_config_slice(bot_id, res.data or [])
 
 
 def get_config(key: str, bot_id: str = "default", default=None):
-    """Fetch a single config value scoped to a BOT_ID."""
+    """Fetch a single config value scoped to a BOT_ID (served from cache)."""
     try:
-        res = (
-            supabase.table("bot_config")
-            .select("value")
-            .eq("bot_id", bot_id)
-            .eq("key", key)
-            .single()
-            .execute()
-        )
-        return res.data["value"] if res.data else default
+        return get_bot_config(bot_id).get(key, default)
     except Exception:
         return default
 
@@ -33,6 +111,13 @@ def set_config(key: str, value: str, bot_id: str = "default"):
     supabase.table("bot_config").upsert(
         {"bot_id": bot_id, "key": key, "value": value}
     ).execute()
+    cache_config_value(key, value, bot_id)
+
+
+def owner_ids() -> set[int]:
+    """Primary admin Telegram IDs from ADMIN_TELEGRAM_ID (comma separated)."""
+    raw = os.getenv("ADMIN_TELEGRAM_ID", "0")
+    return {int(x.strip()) for x in raw.split(",") if x.strip().isdigit()} - {0}
 
 
 def get_all_bot_tokens() -> dict[str, str]:
@@ -40,6 +125,7 @@ def get_all_bot_tokens() -> dict[str, str]:
     Return a dict of {bot_id: token} from env vars.
     Reads BOT_TOKEN_1/BOT_ID_1, BOT_TOKEN_2/BOT_ID_2, etc.
     Also accepts a single BOT_TOKEN/BOT_ID for backward compat.
+    The runtime list of bots (env + `bots` table) is bot.registry.
     """
     tokens = {}
 
@@ -49,8 +135,9 @@ def get_all_bot_tokens() -> dict[str, str]:
     if single_token:
         tokens[single_id] = single_token
 
-    # Multi-bot mode
-    for i in range(1, 6):
+    # Multi-bot mode (any number of BOT_TOKEN_<n> slots)
+    slots = sorted(int(k[10:]) for k in os.environ if k.startswith("BOT_TOKEN_") and k[10:].isdigit())
+    for i in slots:
         token = os.getenv(f"BOT_TOKEN_{i}", "")
         bot_id = os.getenv(f"BOT_ID_{i}", f"bot{i}")
         if token:
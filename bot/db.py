@@ -0,0 +1,442 @@
+"""
+Async data layer for the bot handlers.
+
+Every Supabase query made from inside an ``async def`` handler goes through
+this module so that database I/O never blocks the event loop shared by all
+bots. Built on the async Supabase client (PostgREST over httpx.AsyncClient).
+
+Sections:
+  - config   (bot_config, shares the in-process cache in bot.config)
+  - users    (bot_users)
+  - payments (payments)
+  - admins   (extra_admins config key)
+  - broadcast jobs (broadcast_jobs)
+  - polling leases (bot_leases)
+"""
+import os
+import time
+import asyncio
+import datetime
+import logging
+from supabase import acreate_client, AsyncClient
+from bot.metrics import instrument_supabase
+from bot.config import (
+    SUPABASE_URL, SUPABASE_KEY,
+    cached_config_slice, store_config_slice, cache_config_value,
+    apply_config_versions, CONFIG_POLL_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# bot_users write-behind: flush after this many ms or this many distinct users
+USER_FLUSH_INTERVAL: float = float(os.getenv("USER_FLUSH_INTERVAL_MS", "500")) / 1000
+USER_FLUSH_ROWS: int = int(os.getenv("USER_FLUSH_ROWS", "200"))
+
+# Rows per keyset page. Keep at or below PostgREST's max-rows (1000 on Supabase).
+PAGE_SIZE = 1000
+
+_client: AsyncClient | None = None
+_client_lock = asyncio.Lock()
+
+
+async def get_client() -> AsyncClient:
+    """Return the shared async Supabase client, creating it on first use."""
+    global _client
+    if _client is None:
+        async with _client_lock:
+            if _client is None:
+                _client = instrument_supabase(await acreate_client(SUPABASE_URL, SUPABASE_KEY))
+    return _client
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+async def get_bot_config(bot_id: str = "default") -> dict[str, str]:
+    """Return the whole config slice for a BOT_ID, loading it in one query."""
+    cached = cached_config_slice(bot_id)
+    if cached is not None:
+        return cached
+    db = await get_client()
+    res = await (db.table("bot_config")
+                 .select("key, value")
+                 .eq("bot_id", bot_id)
+                 .execute())
+    return store_config_slice(bot_id, res.data or [])
+
+
+async def load_bot_configs(bot_ids) -> dict[str, dict[str, str]]:
+    """Config slices for several bots; uncached ones are loaded in one query."""
+    configs = {b: cached_config_slice(b) for b in bot_ids}
+    missing = [b for b, cfg in configs.items() if cfg is None]
+    if missing:
+        db = await get_client()
+        res = await (db.table("bot_config")
+                     .select("bot_id, key, value")
+                     .in_("bot_id", missing)
+                     .execute())
+        rows: dict[str, list[dict]] = {b: [] for b in missing}
+        for row in res.data or []:
+            rows[row["bot_id"]].append(row)
+        for b in missing:
+            configs[b] = store_config_slice(b, rows[b])
+    return configs
+
+
+async def get_config(key: str, bot_id: str = "default", default=None):
+    """Fetch a single config value scoped to a BOT_ID (served from cache)."""
+    try:
+        return (await get_bot_config(bot_id)).get(key, default)
+    except Exception:
+        return default
+
+
+async def set_config(key: str, value: str, bot_id: str = "default"):
+    """Upsert a config value scoped to a BOT_ID."""
+    db = await get_client()
+    await db.table("bot_config").upsert(
+        {"bot_id": bot_id, "key": key, "value": value}
+    ).execute()
+    cache_config_value(key, value, bot_id)
+
+
+async def watch_config_versions():
+    """Drop cached config slices written by other processes, until cancelled.
+
+    One small query per CONFIG_POLL_INTERVAL for the whole process; the
+    versions are bumped by a trigger on bot_config (supabase_schema.sql).
+    """
+    warned = False
+    while True:
+        try:
+            db = await get_client()
+            res = await db.table("bot_config_versions").select("bot_id, version").execute()
+            apply_config_versions(res.data or [])
+            warned = False
+        except Exception as e:
+            if not warned:
+                logger.warning(f"Config version poll failed (falling back to CONFIG_CACHE_TTL): {e}")
+                warned = True
+        await asyncio.sleep(CONFIG_POLL_INTERVAL)
+
+
+# ── Users ─────────────────────────────────────────────────────────────────────
+
+class UserWriteBuffer:
+    """
+    Write-behind buffer for bot_users upserts. Rows are de-duplicated by
+    (bot_id, user_id) and written as one bulk upsert every `interval`
+    seconds or as soon as `max_rows` distinct users are waiting.
+    """
+
+    def __init__(self, interval: float = USER_FLUSH_INTERVAL, max_rows: int = USER_FLUSH_ROWS):
+        self.interval = interval
+        self.max_rows = max_rows
+        self._rows: dict[tuple[str, int], dict] = {}
+        self._timer: asyncio.Task | None = None
+        self._due = 0.0
+        self._lock = asyncio.Lock()
+
+    def add(self, bot_id: str, user_id: int, username: str | None, first_name: str | None):
+        self._rows[(bot_id, user_id)] = {
+            "bot_id": bot_id,
+            "user_id": user_id,
+            "username": username,
+            "first_name": first_name,
+            "updated_at": _now(),
+        }
+        if len(self._rows) >= self.max_rows:
+            self._schedule(0)
+        else:
+            self._schedule(self.interval)
+
+    def _schedule(self, delay: float):
+        """Arm the flush timer, or bring it forward if `delay` is sooner."""
+        due = time.monotonic() + delay
+        if self._timer is not None:
+            if self._due <= due:
+                return
+            self._timer.cancel()
+        self._due = due
+        self._timer = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Write every buffered row now. Failed rows are kept for the next flush."""
+        async with self._lock:
+            rows, self._rows = self._rows, {}
+            if not rows:
+                return
+            try:
+                db = await get_client()
+                await db.table("bot_users").upsert(
+                    list(rows.values()), on_conflict="bot_id, user_id"
+                ).execute()
+            except Exception as e:
+                logger.error(f"bot_users flush of {len(rows)} rows failed: {e} — will retry")
+                for key, row in rows.items():
+                    self._rows.setdefault(key, row)
+        if self._rows:
+            self._schedule(self.interval)
+
+    async def close(self):
+        """Cancel the pending timer and flush whatever is buffered."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+
+user_buffer = UserWriteBuffer()
+
+
+def queue_user(bot_id: str, user_id: int, username: str | None, first_name: str | None):
+    """Record a user who interacted with the bot (written in the background)."""
+    user_buffer.add(bot_id, user_id, username, first_name)
+
+
+async def flush_users():
+    await user_buffer.close()
+
+
+async def list_users(bot_id: str, columns: str = "user_id", limit: int | None = None) -> list[dict]:
+    """Return bot_users rows for a bot, newest first when limited."""
+    db = await get_client()
+    q = db.table("bot_users").select(columns).eq("bot_id", bot_id)
+    if limit:
+        q = q.order("created_at", desc=True).limit(limit)
+    res = await q.execute()
+    return res.data or []
+
+
+async def iter_user_ids(table: str, bot_id: str, after: int | None = None,
+                       page_size: int = PAGE_SIZE):
+    """
+    Yield the distinct user_ids of `table` ("bot_users" or "payments") for a bot
+    in ascending order, walking the (bot_id, user_id) index one page at a time.
+    """
+    db = await get_client()
+    last = after
+    while True:
+        q = db.table(table).select("user_id").eq("bot_id", bot_id)
+        if last is not None:
+            q = q.gt("user_id", last)
+        res = await q.order("user_id").limit(page_size).execute()
+        rows = res.data or []
+        if not rows:
+            return
+        for row in rows:
+            if row["user_id"] != last:
+                last = row["user_id"]
+                yield last
+
+
+# ── Payments ──────────────────────────────────────────────────────────────────
+
+async def create_payment(bot_id: str, user_id: int, username: str,
+                         payment_type: str, file_id: str) -> dict | None:
+    """Insert a pending payment and return the created row."""
+    db = await get_client()
+    res = await db.table("payments").insert({
+        "bot_id": bot_id,
+        "user_id": user_id,
+        "username": username,
+        "payment_type": payment_type,
+        "screenshot_file_id": file_id,
+        "status": "pending",
+        "created_at": _now(),
+        "updated_at": _now(),
+    }).execute()
+    return res.data[0] if res.data else None
+
+
+async def get_payment(payment_id: str) -> dict | None:
+    db = await get_client()
+    res = await db.table("payments").select("*").eq("id", payment_id).limit(1).execute()
+    return res.data[0] if res.data else None
+
+
+async def transition_payment(payment_id: str, status: str, from_status: str = "pending") -> dict | None:
+    """Conditional UPDATE … WHERE status = from_status RETURNING *.
+
+    Returns the updated row, or None if the payment was not in `from_status`
+    (someone else already moved it) or does not exist.
+    """
+    db = await get_client()
+    res = await (db.table("payments").update({
+        "status": status,
+        "updated_at": _now(),
+    }).eq("id", payment_id).eq("status", from_status).execute())
+    return res.data[0] if res.data else None
+
+
+async def transition_payments(payment_ids: list[str], status: str, bot_id: str | None = None,
+                              from_status: str = "pending") -> list[dict]:
+    """Set-based transition_payment: returns only the rows this call moved."""
+    db = await get_client()
+    moved: list[dict] = []
+    # Chunked so the id list stays well inside PostgREST's URL length limit
+    for i in range(0, len(payment_ids), 100):
+        q = (db.table("payments").update({
+            "status": status,
+            "updated_at": _now(),
+        }).in_("id", payment_ids[i:i + 100]).eq("status", from_status))
+        if bot_id:
+            q = q.eq("bot_id", bot_id)
+        res = await q.execute()
+        moved.extend(res.data or [])
+    return moved
+
+
+async def set_payment_admin_messages(payment_id: str, messages: list[dict]):
+    """Record the admin cards ({chat_id, message_id, photo}) sent for a payment."""
+    db = await get_client()
+    await db.table("payments").update(
+        {"admin_messages": messages}
+    ).eq("id", payment_id).execute()
+
+
+async def list_payments(bot_id: str, columns: str = "*", status: str | None = None,
+                        limit: int | None = None, newest_first: bool = True) -> list[dict]:
+    """Return payments for a bot, optionally filtered by status."""
+    db = await get_client()
+    q = db.table("payments").select(columns).eq("bot_id", bot_id)
+    if status:
+        q = q.eq("status", status)
+    if limit:
+        q = q.order("created_at", desc=newest_first).limit(limit)
+    res = await q.execute()
+    return res.data or []
+
+
+async def find_user_id_by_username(bot_id: str, username: str) -> int | None:
+    """Look up a paying user's Telegram ID by username (case-insensitive)."""
+    db = await get_client()
+    res = await (db.table("payments")
+                 .select("user_id")
+                 .eq("bot_id", bot_id)
+                 .ilike("username", username)
+                 .limit(1)
+                 .execute())
+    return res.data[0]["user_id"] if res.data else None
+
+
+# ── Stats ─────────────────────────────────────────────────────────────────────
+
+async def get_stats(bot_id: str, extra_ids=()) -> dict:
+    """
+    User and payment counts for a bot, aggregated in Postgres (bot_stats RPC).
+    `audience` is the de-duplicated union of users, payers and `extra_ids`.
+    """
+    db = await get_client()
+    res = await db.rpc("bot_stats", {
+        "p_bot_id": bot_id,
+        "p_extra_ids": sorted(extra_ids),
+    }).execute()
+    data = res.data or {}
+    by_status = data.get("payments") or {}
+    return {
+        "users": data.get("users", 0),
+        "audience": data.get("audience", 0),
+        "payments": sum(by_status.values()),
+        "pending": by_status.get("pending", 0),
+        "confirmed": by_status.get("confirmed", 0),
+        "rejected": by_status.get("rejected", 0),
+    }
+
+
+# ── Admins ────────────────────────────────────────────────────────────────────
+
+def parse_ids(raw: str | None) -> list[int]:
+    """Parse a comma separated list of Telegram IDs, ignoring junk."""
+    return [int(x.strip()) for x in (raw or "").split(",") if x.strip().isdigit()]
+
+
+async def set_extra_admin_ids(bot_id: str, ids: list[int]):
+    await set_config("extra_admins", ",".join(str(i) for i in ids), bot_id)
+
+
+# ── Broadcast jobs ────────────────────────────────────────────────────────────
+
+async def create_broadcast_job(bot_id: str, text: str, total: int,
+                               status_chat_id: int | None = None,
+                               status_message_id: int | None = None,
+                               owner: str | None = None, lease_ttl: float = 0) -> dict:
+    """Insert a running job, already claimed by `owner` for `lease_ttl` seconds."""
+    db = await get_client()
+    lease_until = datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_ttl)
+    res = await db.table("broadcast_jobs").insert({
+        "bot_id": bot_id,
+        "text": text,
+        "status": "running",
+        "total": total,
+        "status_chat_id": status_chat_id,
+        "status_message_id": status_message_id,
+        "owner": owner,
+        "lease_until": lease_until.isoformat() if owner else None,
+        "created_at": _now(),
+        "updated_at": _now(),
+    }).execute()
+    return res.data[0]
+
+
+async def claim_broadcast_job(job_id: str, owner: str, ttl: float) -> bool:
+    """Take or renew a running job's lease. False if another process holds it."""
+    db = await get_client()
+    res = await db.rpc("claim_broadcast_job", {
+        "p_job_id": job_id,
+        "p_owner": owner,
+        "p_ttl_seconds": ttl,
+    }).execute()
+    return bool(res.data)
+
+
+async def release_broadcast_job(job_id: str, owner: str):
+    """Give up a job's lease (paused) so any process can resume it at once."""
+    db = await get_client()
+    await (db.table("broadcast_jobs")
+           .update({"owner": None, "lease_until": None, "updated_at": _now()})
+           .eq("id", job_id).eq("owner", owner).execute())
+
+
+async def update_broadcast_job(job_id: str, fields: dict):
+    db = await get_client()
+    await db.table("broadcast_jobs").update(
+        {**fields, "updated_at": _now()}
+    ).eq("id", job_id).execute()
+
+
+async def list_running_broadcast_jobs(bot_id: str) -> list[dict]:
+    db = await get_client()
+    res = await (db.table("broadcast_jobs")
+                 .select("*")
+                 .eq("bot_id", bot_id)
+                 .eq("status", "running")
+                 .order("created_at")
+                 .execute())
+    return res.data or []
+
+
+# ── Polling leases ────────────────────────────────────────────────────────────
+
+async def acquire_bot_lease(bot_id: str, holder: str, ttl: float) -> bool:
+    """Take or renew the polling lease for a bot. False if another holder has it."""
+    db = await get_client()
+    res = await db.rpc("acquire_bot_lease", {
+        "p_bot_id": bot_id,
+        "p_holder": holder,
+        "p_ttl_seconds": ttl,
+    }).execute()
+    return bool(res.data)
+
+
+async def release_bot_lease(bot_id: str, holder: str):
+    db = await get_client()
+    await db.table("bot_leases").delete().eq("bot_id", bot_id).eq("holder", holder).execute()
@@ -12,40 +12,26 @@ Features:
   - Stats
   - Broadcast to all approved users
 """
-import os
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ContextTypes, ConversationHandler, CommandHandler,
     CallbackQueryHandler, MessageHandler, filters,
 )
-from bot.config import get_config, set_config, supabase
+from bot.db import (
+    get_config, set_config, list_users, list_payments,
+    find_user_id_by_username, get_stats,
+)
+from bot.admins import OWNER_IDS, is_admin, is_owner, extra_admin_ids, add_admin, remove_admin
+from bot.broadcast import count_recipients, create_job
+from bot.payments import (
+    decide_payment, decide_payments, announce_decision, announce_decisions, result_text,
+    PaymentAlreadyDecided, PaymentNotFound,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def _owner_ids() -> set[int]:
-    try:
-        raw = os.getenv("ADMIN_TELEGRAM_ID", "0")
-        return {int(x.strip()) for x in raw.split(",") if x.strip().isdigit()}
-    except Exception:
-        return {0}
-
-
-def is_admin(user_id: int, bot_id: str = "default") -> bool:
-    """Check primary admin OR extra admins stored in Supabase."""
-    if user_id in _owner_ids():
-        return True
-    try:
-        raw = get_config("extra_admins", bot_id, "")
-        if raw:
-            ids = [int(x.strip()) for x in raw.split(",") if x.strip().isdigit()]
-            return user_id in ids
-    except Exception:
-        pass
-    return False
-
-
 # ─── States ───────────────────────────────────────────────────────────────────
 (
     MAIN_MENU,
@@ -171,7 +157,7 @@ async def _show_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def manage_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_id = context.bot_data.get("bot_id", "default")
-    if not is_admin(update.effective_user.id, bot_id):
+    if not await is_admin(update.effective_user.id, bot_id):
         try:
             await update.message.reply_text("⛔ You are not authorized to use this command.")
         except Exception:
@@ -189,8 +175,8 @@ async def cb_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cb_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    cur_text = get_config("welcome_text", bot_id, "(not set)")
-    cur_photo = get_config("welcome_media_url", bot_id, "")
+    cur_text = await get_config("welcome_text", bot_id, "(not set)")
+    cur_photo = await get_config("welcome_media_url", bot_id, "")
     await _edit_or_send(update,
         f"👋 <b>Welcome Settings</b>\n\n"
         f"<b>Photo:</b> {'✅ Set' if cur_photo else '❌ None'}\n\n"
@@ -203,8 +189,8 @@ async def cb_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cb_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    cur_text = get_config("premium_text", bot_id, "(not set)")
-    cur_photo = get_config("premium_photo_url", bot_id, "")
+    cur_text = await get_config("premium_text", bot_id, "(not set)")
+    cur_photo = await get_config("premium_photo_url", bot_id, "")
     await _edit_or_send(update,
         f"💎 <b>Premium Settings</b>\n\n"
         f"<b>Photo:</b> {'✅ Set' if cur_photo else '❌ None'}\n\n"
@@ -217,8 +203,8 @@ async def cb_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cb_upi(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    cur_msg = get_config("upi_message", bot_id, "(not set)")
-    cur_qr = get_config("upi_qr_url", bot_id, "")
+    cur_msg = await get_config("upi_message", bot_id, "(not set)")
+    cur_qr = await get_config("upi_qr_url", bot_id, "")
     await _edit_or_send(update,
         f"💳 <b>UPI Payment Settings</b>\n\n"
         f"<b>QR Photo:</b> {'✅ Set' if cur_qr else '❌ None'}\n\n"
@@ -231,8 +217,8 @@ async def cb_upi(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cb_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    cur_msg = get_config("crypto_message", bot_id, "(not set)")
-    cur_qr = get_config("crypto_qr_url", bot_id, "")
+    cur_msg = await get_config("crypto_message", bot_id, "(not set)")
+    cur_qr = await get_config("crypto_qr_url", bot_id, "")
     await _edit_or_send(update,
         f"₿ <b>Crypto Payment Settings</b>\n\n"
         f"<b>QR Photo:</b> {'✅ Set' if cur_qr else '❌ None'}\n\n"
@@ -245,8 +231,8 @@ async def cb_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cb_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    demo = get_config("demo_button_url", bot_id, "(not set)")
-    howto = get_config("how_to_use_button_url", bot_id, "(not set)")
+    demo = await get_config("demo_button_url", bot_id, "(not set)")
+    howto = await get_config("how_to_use_button_url", bot_id, "(not set)")
     await _edit_or_send(update,
         f"🔗 <b>Button Links</b>\n\n"
         f"<b>🎥 Demo URL:</b>\n<code>{demo}</code>\n\n"
@@ -260,19 +246,12 @@ async def cb_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
     try:
-        # Get users from bot_users table (real tracking)
-        all_u = (supabase.table("bot_users")
-                 .select("user_id")
-                 .eq("bot_id", bot_id)
-                 .execute().data or [])
-        unique_users = len(all_u)
-        
-        # Get payments stats
-        all_p = supabase.table("payments").select("status").eq("bot_id", bot_id).execute().data or []
-        total_p  = len(all_p)
-        pending  = sum(1 for p in all_p if p["status"] == "pending")
-        approved = sum(1 for p in all_p if p["status"] == "confirmed")
-        rejected = sum(1 for p in all_p if p["status"] == "rejected")
+        stats = await get_stats(bot_id)
+        unique_users = stats["users"]
+        total_p  = stats["payments"]
+        pending  = stats["pending"]
+        approved = stats["confirmed"]
+        rejected = stats["rejected"]
     except Exception as e:
         logger.error(f"cb_stats error: {e}")
         unique_users = "?"
@@ -315,22 +294,10 @@ async def cb_users_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_id = context.bot_data.get("bot_id", "default")
     try:
         # Fetch from bot_users (primary source)
-        res_u = (supabase.table("bot_users")
-                 .select("user_id, username, created_at")
-                 .eq("bot_id", bot_id)
-                 .order("created_at", desc=True)
-                 .limit(50)
-                 .execute())
-        users_u = res_u.data or []
+        users_u = await list_users(bot_id, "user_id, username, created_at", limit=50)
         
         # Fetch from payments for completeness (legacy)
-        res_p = (supabase.table("payments")
-                 .select("user_id, username, created_at")
-                 .eq("bot_id", bot_id)
-                 .order("created_at", desc=True)
-                 .limit(50)
-                 .execute())
-        users_p = res_p.data or []
+        users_p = await list_payments(bot_id, "user_id, username, created_at", limit=50)
         
         # Combine
         all_raw = users_u + users_p
@@ -373,14 +340,8 @@ async def cb_users_approved(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
     try:
-        res = (supabase.table("payments")
-               .select("user_id, username, created_at, payment_type")
-               .eq("bot_id", bot_id)
-               .eq("status", "confirmed")
-               .order("created_at", desc=True)
-               .limit(50)
-               .execute())
-        users = res.data or []
+        users = await list_payments(bot_id, "user_id, username, created_at, payment_type",
+                                    status="confirmed", limit=50)
     except Exception as e:
         logger.error(f"cb_users_approved error: {e}")
         users = []
@@ -422,14 +383,7 @@ async def cb_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
     try:
-        res = (supabase.table("payments")
-               .select("*")
-               .eq("bot_id", bot_id)
-               .eq("status", "pending")
-               .order("created_at", desc=False)
-               .limit(10)
-               .execute())
-        payments = res.data or []
+        payments = await list_payments(bot_id, status="pending", limit=10, newest_first=False)
     except Exception as e:
         logger.error(f"cb_payments error: {e}")
         payments = []
@@ -448,6 +402,7 @@ async def cb_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         pass
 
+    shown: dict[str, dict] = {}
     for p in payments:
         pid   = p["id"]
         uname = p.get("username", "Unknown")
@@ -470,19 +425,25 @@ async def cb_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]])
         try:
             if file_id:
-                await update.effective_chat.send_photo(
+                msg = await update.effective_chat.send_photo(
                     photo=file_id, caption=caption, reply_markup=kb, parse_mode="HTML"
                 )
             else:
-                await update.effective_chat.send_message(
+                msg = await update.effective_chat.send_message(
                     caption, reply_markup=kb, parse_mode="HTML"
                 )
+            shown[pid] = {"chat_id": msg.chat_id, "message_id": msg.message_id, "photo": bool(file_id)}
         except Exception as e:
             logger.error(f"send payment card error: {e}")
 
+    # Remembered for "Approve all shown" (callback_data is too small for the IDs)
+    context.chat_data["shown_payments"] = shown
     try:
         await update.effective_chat.send_message(
             "👆 Use the buttons above to approve or reject.\nSend /manage to return to main menu.",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(f"✅ Approve all shown ({len(shown)})", callback_data="mgr_bulk_approve"),
+            ]]) if shown else None,
         )
     except Exception:
         pass
@@ -490,60 +451,37 @@ async def cb_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ─── Approve / Reject ─────────────────────────────────────────────────────────
-async def cb_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.answer("Processing...")
-    payment_id = update.callback_query.data.replace("mgr_approve_", "")
-    bot_id = context.bot_data.get("bot_id", "default")
+async def _decide(update: Update, context: ContextTypes.DEFAULT_TYPE, payment_id: str, status: str):
+    """Apply an approve/reject tap. Only the admin whose update wins notifies anyone."""
+    query = update.callback_query
+    try:
+        p, changed = await decide_payment(payment_id, status)
+    except PaymentAlreadyDecided as e:
+        p, changed = e.payment, False
+    except PaymentNotFound:
+        await update.effective_chat.send_message("⚠️ Payment not found.")
+        return
+    result = result_text(p)
+    if not changed:
+        result += "\n<i>(already handled by another admin)</i>"
     try:
-        res = supabase.table("payments").select("*").eq("id", payment_id).single().execute()
-        p = res.data
-        supabase.table("payments").update({"status": "confirmed"}).eq("id", payment_id).execute()
-
-        # Get the join link from config
-        join_url = get_config("join_link", bot_id, "")
-        join_url = join_url.strip() if join_url else ""
-        # Normalize @username -> https://t.me/username
-        if join_url.startswith("@"):
-            join_url = f"https://t.me/{join_url[1:]}"
-        elif join_url and not join_url.startswith(("http://", "https://")):
-            join_url = f"https://{join_url}"
-
-        msg_text = (
-            "🎉 <b>Payment Confirmed!</b>\n\n"
-            "Your premium access has been activated. "
-            "Tap the button below to join. Thank you! 🙏"
+        await query.edit_message_caption(caption=result, parse_mode="HTML", reply_markup=None)
+    except Exception:
+        done = "✅ Payment approved." if p["status"] == "confirmed" else "❌ Payment rejected."
+        await update.effective_chat.send_message(done)
+    if changed:
+        msg = query.message
+        context.application.create_task(
+            announce_decision(context.bot, p, skip=(msg.chat_id, msg.message_id)),
+            update=update,
         )
 
-        if join_url:
-            kb = InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔗 Join Now", url=join_url)
-            ]])
-            try:
-                await context.bot.send_message(
-                    chat_id=p["user_id"], text=msg_text,
-                    reply_markup=kb, parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.warning(f"Could not notify user {p['user_id']}: {e}")
-        else:
-            # No join link set — send plain text
-            try:
-                await context.bot.send_message(
-                    chat_id=p["user_id"],
-                    text="🎉 <b>Payment Confirmed!</b>\n\nYour premium access has been activated. Thank you! 🙏",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.warning(f"Could not notify user {p['user_id']}: {e}")
 
-        try:
-            await update.callback_query.edit_message_caption(
-                caption=f"✅ <b>APPROVED</b> — @{p.get('username','?')} ({p.get('payment_type','?').upper()})",
-                parse_mode="HTML",
-                reply_markup=None,
-            )
-        except Exception:
-            await update.effective_chat.send_message("✅ Payment approved.")
+async def cb_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer("Processing...")
+    payment_id = update.callback_query.data.replace("mgr_approve_", "")
+    try:
+        await _decide(update, context, payment_id, "confirmed")
     except Exception as e:
         logger.error(f"approve error: {e}")
     return MAIN_MENU
@@ -553,41 +491,48 @@ async def cb_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer("Processing...")
     payment_id = update.callback_query.data.replace("mgr_reject_", "")
     try:
-        res = supabase.table("payments").select("*").eq("id", payment_id).single().execute()
-        p = res.data
-        supabase.table("payments").update({"status": "rejected"}).eq("id", payment_id).execute()
-        try:
-            await context.bot.send_message(
-                chat_id=p["user_id"],
-                text="❌ <b>Payment Rejected</b>\n\nYour payment could not be verified. Please contact support.",
-                parse_mode="HTML",
-            )
-        except Exception as e:
-            logger.warning(f"Could not notify user {p['user_id']}: {e}")
-
-        try:
-            await update.callback_query.edit_message_caption(
-                caption=f"❌ <b>REJECTED</b> — @{p.get('username','?')} ({p.get('payment_type','?').upper()})",
-                parse_mode="HTML",
-                reply_markup=None,
-            )
-        except Exception:
-            await update.effective_chat.send_message("❌ Payment rejected.")
+        await _decide(update, context, payment_id, "rejected")
     except Exception as e:
         logger.error(f"reject error: {e}")
     return MAIN_MENU
 
 
+async def cb_bulk_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Approve every card the last Payments listing showed, in one update."""
+    await update.callback_query.answer("Processing...")
+    bot_id = context.bot_data.get("bot_id", "default")
+    shown = context.chat_data.pop("shown_payments", None) or {}
+    if not shown:
+        await _edit_or_send(update, "⚠️ Nothing to approve — open 📋 Payments again.", _back_kb())
+        return MAIN_MENU
+    try:
+        approved = await decide_payments(list(shown), "confirmed", bot_id)
+    except Exception as e:
+        logger.error(f"bulk approve error: {e}")
+        await _edit_or_send(update, "❌ Bulk approve failed.", _back_kb())
+        return MAIN_MENU
+
+    # Also update the cards in this chat (they are not in admin_messages)
+    approved = [{**p, "admin_messages": (p.get("admin_messages") or []) + [shown[p["id"]]]}
+                for p in approved if p["id"] in shown]
+    context.application.create_task(announce_decisions(context.bot, approved), update=update)
+    skipped = len(shown) - len(approved)
+    text = f"✅ <b>Approved {len(approved)} payment(s).</b>"
+    if skipped:
+        text += f"\n{skipped} were already handled by another admin."
+    await _edit_or_send(update, text, _back_kb())
+    return MAIN_MENU
+
+
 # ─── Section: Admin Control ──────────────────────────────────────────────────
 async def cb_admin_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    raw = get_config("extra_admins", bot_id, "")
-    extra_ids = [x.strip() for x in raw.split(",") if x.strip().isdigit()] if raw else []
+    extra_ids = await extra_admin_ids(bot_id)
 
     lines = [f"👤 <b>Admin Control — {bot_id.upper()}</b>\n"]
     lines = [f"👤 <b>Admin Control — {bot_id.upper()}</b>\n"]
-    owners = _owner_ids()
+    owners = OWNER_IDS
     lines.append(f"<b>Owner(s):</b> {', '.join(map(str, owners))}\n")
     
     if extra_ids:
@@ -599,9 +544,7 @@ async def cb_admin_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Build keyboard: remove buttons for each extra admin + add button (Owner only)
     rows = []
-    is_owner = (update.effective_user.id in owners)
-
-    if is_owner:
+    if is_owner(update.effective_user.id):
         for uid in extra_ids:
             rows.append([InlineKeyboardButton(f"➖ Remove {uid}", callback_data=f"mgr_rmadmin_{uid}")])
         rows.append([InlineKeyboardButton("➕ Add Admin", callback_data="mgr_add_admin")])
@@ -616,7 +559,7 @@ async def cb_admin_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cb_add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    if update.effective_user.id not in _owner_ids():
+    if not is_owner(update.effective_user.id):
         await update.effective_chat.send_message("⛔ Only Owners (Primary Admins) can add other admins.")
         return MAIN_MENU
 
@@ -629,7 +572,7 @@ async def cb_add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def recv_add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in _owner_ids():
+    if not is_owner(update.effective_user.id):
         return ConversationHandler.END
 
     bot_id = context.bot_data.get("bot_id", "default")
@@ -642,14 +585,7 @@ async def recv_add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # Search by username in payments table
         try:
-            res = (supabase.table("payments")
-                   .select("user_id")
-                   .eq("bot_id", bot_id)
-                   .ilike("username", text)
-                   .limit(1)
-                   .execute())
-            if res.data:
-                new_id = res.data[0]["user_id"]
+            new_id = await find_user_id_by_username(bot_id, text)
         except Exception as e:
             logger.error(f"recv_add_admin lookup error: {e}")
 
@@ -659,11 +595,7 @@ async def recv_add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return AWAIT_ADD_ADMIN
 
     # Don't double-add
-    raw = get_config("extra_admins", bot_id, "")
-    ids = [x.strip() for x in raw.split(",") if x.strip().isdigit()] if raw else []
-    if str(new_id) not in ids:
-        ids.append(str(new_id))
-        set_config("extra_admins", ",".join(ids), bot_id)
+    await add_admin(bot_id, int(new_id))
 
     await update.message.reply_text(
         f"✅ <b>Admin added!</b> User <code>{new_id}</code> can now use /manage on this bot.",
@@ -673,14 +605,13 @@ async def recv_add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cb_remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer("Removing...")
-    if update.effective_user.id not in _owner_ids():
+    if not is_owner(update.effective_user.id):
         return MAIN_MENU
 
     bot_id = context.bot_data.get("bot_id", "default")
     rm_id = update.callback_query.data.replace("mgr_rmadmin_", "").strip()
-    raw = get_config("extra_admins", bot_id, "")
-    ids = [x.strip() for x in raw.split(",") if x.strip().isdigit() and x.strip() != rm_id] if raw else []
-    set_config("extra_admins", ",".join(ids), bot_id)
+    if rm_id.isdigit():
+        await remove_admin(bot_id, int(rm_id))
     return await cb_admin_control(update, context)
 
 
@@ -690,31 +621,7 @@ async def cb_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_id = context.bot_data.get("bot_id", "default")
     # Pre-load user count so admin knows what they're broadcasting to
     try:
-        # 1. Users from bot_users (start command)
-        res_u = (supabase.table("bot_users")
-                 .select("user_id")
-                 .eq("bot_id", bot_id)
-                 .execute())
-        user_ids = {r["user_id"] for r in (res_u.data or [])}
-
-        # 2. Users from payments (legacy/paid)
-        res_p = (supabase.table("payments")
-                 .select("user_id")
-                 .eq("bot_id", bot_id)
-                 .execute())
-        pay_ids = {r["user_id"] for r in (res_p.data or [])}
-
-        # 3. Extra admins
-        raw = get_config("extra_admins", bot_id, "")
-        extra_ids = {int(x.strip()) for x in raw.split(",") if x.strip().isdigit()}
-
-        # 4. Primary admins (owners)
-        owners = _owner_ids() - {0}
-        extra_ids.update(owners)
-
-        # Union of all unique IDs
-        all_ids = user_ids | pay_ids | extra_ids
-        total_users = len(all_ids)
+        total_users = await count_recipients(bot_id)
     except Exception:
         total_users = "?"
 
@@ -732,51 +639,17 @@ async def recv_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_id = context.bot_data.get("bot_id", "default")
     text = update.message.text
     try:
-        # 1. Users from bot_users (start command)
-        res_u = (supabase.table("bot_users")
-                 .select("user_id, username")
-                 .eq("bot_id", bot_id)
-                 .execute())
-        rows_u = res_u.data or []
-
-        # 2. Users from payments (legacy/paid)
-        res_p = (supabase.table("payments")
-                 .select("user_id, username")
-                 .eq("bot_id", bot_id)
-                 .execute())
-        rows_p = res_p.data or []
-
-        all_rows = rows_u + rows_p
+        total = await count_recipients(bot_id)
     except Exception as e:
         logger.error(f"broadcast fetch error: {e}")
         await update.message.reply_text("❌ Failed to fetch users. Please try again.")
         return ConversationHandler.END
 
-    # Deduplicate by user_id
-    seen = {}
-    for r in all_rows:
-        seen[r["user_id"]] = r.get("username", str(r["user_id"]))
-    
-    # Add admins if missing
-    raw = get_config("extra_admins", bot_id, "")
-    for x in raw.split(","):
-        if x.strip().isdigit():
-            uid = int(x.strip())
-            if uid not in seen:
-                seen[uid] = str(uid)
-
-    for owner_id in _owner_ids():
-        if owner_id and owner_id not in seen and owner_id != 0:
-            seen[owner_id] = "Primary Admin"
-
-    user_ids = list(seen.keys())
-    total = len(user_ids)
-
     if total == 0:
         await update.message.reply_text("❌ No approved users to broadcast to.")
         return await _confirm(update, context, "Broadcast cancelled — no users.")
 
-    # Show live progress status
+    # Status message is edited by the engine from the job record
     status_msg = await update.message.reply_text(
         f"📢 <b>Broadcast Starting...</b>\n\n"
         f"👥 Total users: <b>{total}</b>\n"
@@ -784,63 +657,22 @@ async def recv_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="HTML"
     )
 
-    sent = failed = blocked = 0
-    failed_users = []
-
-    for i, uid in enumerate(user_ids, 1):
-        try:
-            await context.bot.send_message(chat_id=uid, text=text, parse_mode="HTML")
-            sent += 1
-        except Exception as e:
-            err_str = str(e).lower()
-            if "blocked" in err_str or "deactivated" in err_str or "not found" in err_str:
-                blocked += 1
-            else:
-                failed += 1
-            failed_users.append(f"@{seen.get(uid, uid)}")
-
-        # Update progress every 5 users
-        if i % 5 == 0 or i == total:
-            try:
-                await status_msg.edit_text(
-                    f"📢 <b>Broadcasting...</b>\n\n"
-                    f"👥 Total: <b>{total}</b>\n"
-                    f"✅ Sent: <b>{sent}</b>\n"
-                    f"⏳ Remaining: <b>{total - i}</b>",
-                    parse_mode="HTML"
-                )
-            except Exception:
-                pass
-
-    # Final completion report
-    failed_note = ""
-    if failed_users:
-        sample = ", ".join(failed_users[:5])
-        if len(failed_users) > 5:
-            sample += f" +{len(failed_users) - 5} more"
-        failed_note = f"\n\n<b>Failed users:</b> {sample}"
-
     try:
-        await status_msg.edit_text(
-            f"📢 <b>Broadcast Completed Successfully! 🎉</b>\n\n"
-            f"👥 Total users: <b>{total}</b>\n"
-            f"✅ Delivered: <b>{sent}</b>\n"
-            f"🚫 Blocked/Inactive: <b>{blocked}</b>\n"
-            f"❌ Other failures: <b>{failed}</b>"
-            f"{failed_note}",
-            parse_mode="HTML"
-        )
-    except Exception:
-        pass
+        await create_job(context.application, bot_id, text, total,
+                         status_msg.chat_id, status_msg.message_id)
+    except Exception as e:
+        logger.error(f"broadcast job create error: {e}")
+        await update.message.reply_text("❌ Failed to start broadcast. Please try again.")
+        return await _show_main(update, context)
 
-    return await _confirm(update, context, f"Broadcast done! ✅ {sent}/{total} delivered.")
+    return await _confirm(update, context, f"Broadcast queued for {total} users — progress is shown above.")
 
 
 # ─── Section: Join Link ──────────────────────────────────────────────────────
 async def cb_join_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    cur = get_config("join_link", bot_id, "(not set)")
+    cur = await get_config("join_link", bot_id, "(not set)")
     await _edit_or_send(update,
         f"🔗 <b>Join Link</b>\n\n"
         f"<b>Current:</b> <code>{cur}</code>\n\n"
@@ -854,7 +686,7 @@ async def recv_join_link(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
     url = _fix_url(update.message.text)
     try:
-        set_config("join_link", url, bot_id)
+        await set_config("join_link", url, bot_id)
     except Exception as e:
         logger.error(e)
         await update.message.reply_text("❌ Save failed.")
@@ -895,28 +727,28 @@ async def cb_set_howto_url(u, c):
 async def cb_del_welcome_photo(update, context):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    try: set_config("welcome_media_url", "", bot_id)
+    try: await set_config("welcome_media_url", "", bot_id)
     except Exception as e: logger.error(e)
     return await _confirm(update, context, "Welcome photo removed!")
 
 async def cb_del_premium_photo(update, context):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    try: set_config("premium_photo_url", "", bot_id)
+    try: await set_config("premium_photo_url", "", bot_id)
     except Exception as e: logger.error(e)
     return await _confirm(update, context, "Premium photo removed!")
 
 async def cb_del_upi_qr(update, context):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    try: set_config("upi_qr_url", "", bot_id)
+    try: await set_config("upi_qr_url", "", bot_id)
     except Exception as e: logger.error(e)
     return await _confirm(update, context, "UPI QR removed!")
 
 async def cb_del_crypto_qr(update, context):
     await update.callback_query.answer()
     bot_id = context.bot_data.get("bot_id", "default")
-    try: set_config("crypto_qr_url", "", bot_id)
+    try: await set_config("crypto_qr_url", "", bot_id)
     except Exception as e: logger.error(e)
     return await _confirm(update, context, "Crypto QR removed!")
 
@@ -932,7 +764,7 @@ def _photo_id(msg):
 
 async def recv_welcome_text(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
-    try:    set_config("welcome_text", update.message.text, bot_id)
+    try:    await set_config("welcome_text", update.message.text, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_WELCOME_TEXT
     return await _confirm(update, context, "Welcome text updated!")
@@ -941,14 +773,14 @@ async def recv_welcome_photo(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
     fid = _photo_id(update.message)
     if not fid: await update.message.reply_text("❌ Send a photo."); return AWAIT_WELCOME_PHOTO
-    try:    set_config("welcome_media_url", fid, bot_id)
+    try:    await set_config("welcome_media_url", fid, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_WELCOME_PHOTO
     return await _confirm(update, context, "Welcome photo updated!")
 
 async def recv_premium_text(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
-    try:    set_config("premium_text", update.message.text, bot_id)
+    try:    await set_config("premium_text", update.message.text, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_PREMIUM_TEXT
     return await _confirm(update, context, "Premium text updated!")
@@ -957,7 +789,7 @@ async def recv_premium_photo(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
     fid = _photo_id(update.message)
     if not fid: await update.message.reply_text("❌ Send a photo."); return AWAIT_PREMIUM_PHOTO
-    try:    set_config("premium_photo_url", fid, bot_id)
+    try:    await set_config("premium_photo_url", fid, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_PREMIUM_PHOTO
     return await _confirm(update, context, "Premium photo updated!")
@@ -966,14 +798,14 @@ async def recv_upi_qr(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
     fid = _photo_id(update.message)
     if not fid: await update.message.reply_text("❌ Send a photo."); return AWAIT_UPI_QR
-    try:    set_config("upi_qr_url", fid, bot_id)
+    try:    await set_config("upi_qr_url", fid, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_UPI_QR
     return await _confirm(update, context, "UPI QR updated!")
 
 async def recv_upi_msg(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
-    try:    set_config("upi_message", update.message.text, bot_id)
+    try:    await set_config("upi_message", update.message.text, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_UPI_MSG
     return await _confirm(update, context, "UPI message updated!")
@@ -982,14 +814,14 @@ async def recv_crypto_qr(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
     fid = _photo_id(update.message)
     if not fid: await update.message.reply_text("❌ Send a photo."); return AWAIT_CRYPTO_QR
-    try:    set_config("crypto_qr_url", fid, bot_id)
+    try:    await set_config("crypto_qr_url", fid, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_CRYPTO_QR
     return await _confirm(update, context, "Crypto QR updated!")
 
 async def recv_crypto_msg(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
-    try:    set_config("crypto_message", update.message.text, bot_id)
+    try:    await set_config("crypto_message", update.message.text, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_CRYPTO_MSG
     return await _confirm(update, context, "Crypto message updated!")
@@ -997,7 +829,7 @@ async def recv_crypto_msg(update, context):
 async def recv_demo_url(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
     url = _fix_url(update.message.text)
-    try:    set_config("demo_button_url", url, bot_id)
+    try:    await set_config("demo_button_url", url, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_DEMO_URL
     await update.message.reply_text(f"✅ Saved: <code>{url}</code>", parse_mode="HTML")
@@ -1006,7 +838,7 @@ async def recv_demo_url(update, context):
 async def recv_howto_url(update, context):
     bot_id = context.bot_data.get("bot_id", "default")
     url = _fix_url(update.message.text)
-    try:    set_config("how_to_use_button_url", url, bot_id)
+    try:    await set_config("how_to_use_button_url", url, bot_id)
     except Exception as e:
         logger.error(e); await update.message.reply_text("❌ Save failed."); return AWAIT_HOW_TO_URL
     await update.message.reply_text(f"✅ Saved: <code>{url}</code>", parse_mode="HTML")
@@ -1062,6 +894,7 @@ def build_manage_handler() -> ConversationHandler:
         # Payments
         CallbackQueryHandler(cb_approve, pattern=r"^mgr_approve_.+$"),
         CallbackQueryHandler(cb_reject,  pattern=r"^mgr_reject_.+$"),
+        CallbackQueryHandler(cb_bulk_approve, pattern="^mgr_bulk_approve$"),
     ]
 
     return ConversationHandler(
@@ -1085,4 +918,6 @@ def build_manage_handler() -> ConversationHandler:
         fallbacks=[CommandHandler("cancel", cancel_manage)],
         allow_reentry=True,
         per_chat=True,
+        name="manage",
+        persistent=True,
     )
@@ -1,9 +1,9 @@
-import os
 import logging
-import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from bot.config import supabase
+from bot.db import create_payment
+from bot.admins import admin_ids
+from bot.notify import notify_admins
 
 logger = logging.getLogger(__name__)
 
@@ -11,14 +11,6 @@ WAITING_SCREENSHOT_UPI = 1
 WAITING_SCREENSHOT_CRYPTO = 2
 
 
-def _owner_ids() -> set[int]:
-    try:
-        raw = os.getenv("ADMIN_TELEGRAM_ID", "0")
-        return {int(x.strip()) for x in raw.split(",") if x.strip().isdigit()}
-    except Exception:
-        return {0}
-
-
 async def paid_upi_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     try:
@@ -63,6 +55,32 @@ async def paid_crypto_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     return WAITING_SCREENSHOT_CRYPTO
 
 
+async def _notify_payment(bot, bot_id: str, payment_id: str, file_id: str,
+                          username_str: str, user_id: int, payment_type: str):
+    """Real-time payment card with Approve/Reject to every owner and extra admin."""
+    # Owners + extra admins for this bot (in-memory registry)
+    try:
+        all_admin_ids = [aid for aid in await admin_ids(bot_id) if aid > 0]
+    except Exception:
+        return
+    if not all_admin_ids:
+        return
+
+    caption = (
+        f"💰 <b>PAYMENT REQUEST</b>\n\n"
+        f"🤖 Bot: <b>{bot_id.upper()}</b>\n"
+        f"👤 User: {username_str}\n"
+        f"🆔 ID: <code>{user_id}</code>\n"
+        f"💳 Method: <b>{payment_type.upper()}</b>\n\n"
+        f"<i>First admin action will be final.</i>"
+    )
+    kb = InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ APPROVE", callback_data=f"mgr_approve_{payment_id}"),
+        InlineKeyboardButton("❌ REJECT",  callback_data=f"mgr_reject_{payment_id}"),
+    ]])
+    await notify_admins(bot, bot_id, all_admin_ids, payment_id, file_id, caption, kb)
+
+
 async def receive_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     payment_type = context.user_data.get("payment_type", "upi")
@@ -83,18 +101,12 @@ async def receive_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Save to Supabase
     payment_id = None
     try:
-        result = supabase.table("payments").insert({
-            "bot_id": bot_id,
-            "user_id": user.id,
-            "username": user.username or user.first_name or str(user.id),
-            "payment_type": payment_type,
-            "screenshot_file_id": file_id,
-            "status": "pending",
-            "created_at": datetime.datetime.utcnow().isoformat(),
-            "updated_at": datetime.datetime.utcnow().isoformat(),
-        }).execute()
-        if result.data:
-            payment_id = result.data[0].get("id")
+        row = await create_payment(
+            bot_id, user.id, user.username or user.first_name or str(user.id),
+            payment_type, file_id,
+        )
+        if row:
+            payment_id = row.get("id")
         logger.info(f"[{bot_id}] Payment saved for user {user.id} ({payment_type}) id={payment_id}")
     except Exception as e:
         logger.error(f"[{bot_id}] Supabase insert failed: {e}")
@@ -107,6 +119,14 @@ async def receive_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE)
             pass
         return ConversationHandler.END
 
+    # ── Notify ALL admins in the background — the user isn't kept waiting ─────
+    if payment_id:
+        username_str = f"@{user.username}" if user.username else str(user.id)
+        context.application.create_task(
+            _notify_payment(context.bot, bot_id, payment_id, file_id, username_str, user.id, payment_type),
+            update=update,
+        )
+
     # Confirm to user immediately
     try:
         await update.message.reply_text(
@@ -117,58 +137,6 @@ async def receive_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         logger.error(f"reply_text error: {e}")
 
-    # ── Notify ALL admins — real-time payment card with Approve/Reject ─────────
-    # ── Notify ALL admins — real-time payment card with Approve/Reject ─────────
-    owners = _owner_ids()
-    # Gather extra admins from Supabase for this bot
-    extra_ids = []
-    try:
-        from bot.config import get_config as _get_cfg
-        raw = _get_cfg("extra_admins", bot_id, "")
-        if raw:
-            extra_ids = [int(x.strip()) for x in raw.split(",") if x.strip().isdigit()]
-    except Exception:
-        pass
-
-    all_admin_ids = list(owners | set(extra_ids))
-    # Remove 0 or invalid IDs just in case
-    all_admin_ids = [aid for aid in all_admin_ids if aid > 0]
-
-    if all_admin_ids and payment_id:
-        username_str = f"@{user.username}" if user.username else str(user.id)
-        caption = (
-            f"💰 <b>PAYMENT REQUEST</b>\n\n"
-            f"🤖 Bot: <b>{bot_id.upper()}</b>\n"
-            f"👤 User: {username_str}\n"
-            f"🆔 ID: <code>{user.id}</code>\n"
-            f"💳 Method: <b>{payment_type.upper()}</b>\n\n"
-            f"<i>First admin action will be final.</i>"
-        )
-        kb = InlineKeyboardMarkup([[
-            InlineKeyboardButton("✅ APPROVE", callback_data=f"mgr_approve_{payment_id}"),
-            InlineKeyboardButton("❌ REJECT",  callback_data=f"mgr_reject_{payment_id}"),
-        ]])
-        for aid in all_admin_ids:
-            try:
-                await context.bot.send_photo(
-                    chat_id=aid,
-                    photo=file_id,
-                    caption=caption,
-                    reply_markup=kb,
-                    parse_mode="HTML",
-                )
-            except Exception as e:
-                logger.warning(f"[{bot_id}] Photo notify to {aid} failed: {e} — trying text")
-                try:
-                    await context.bot.send_message(
-                        chat_id=aid,
-                        text=caption,
-                        reply_markup=kb,
-                        parse_mode="HTML",
-                    )
-                except Exception as e2:
-                    logger.error(f"[{bot_id}] Notify to admin {aid} completely failed: {e2}")
-
     context.user_data.clear()
     return ConversationHandler.END
 
@@ -2,7 +2,8 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import TelegramError, BadRequest
 from telegram.ext import ContextTypes
-from bot.config import get_config, supabase
+from bot.db import get_config, queue_user
+from bot.media import cached_file_id, remember_file_id, forget_media
 
 logger = logging.getLogger(__name__)
 
@@ -35,20 +36,30 @@ async def _safe_delete(message):
 async def _send_with_photo_fallback(context, chat_id, photo_url, text, reply_markup):
     """
     Try send_photo first. If URL is bad/empty, fall back to send_message.
+    URLs are sent by their cached Telegram file_id once one is known.
     Never crashes regardless of what the admin sets.
     """
     if photo_url and photo_url.strip():
-        try:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo_url.strip(),
-                caption=text or "‼️ No message configured.",
-                reply_markup=reply_markup,
-                parse_mode="HTML",
-            )
-            return
-        except (TelegramError, BadRequest, Exception) as e:
-            logger.warning(f"send_photo failed (url={photo_url!r}): {e} — falling back to text")
+        bot_id = context.bot_data.get("bot_id", "default")
+        photo = photo_url.strip()
+        file_id = cached_file_id(bot_id, photo)
+        for candidate in ([file_id] if file_id else []) + [photo]:
+            try:
+                msg = await context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=candidate,
+                    caption=text or "‼️ No message configured.",
+                    reply_markup=reply_markup,
+                    parse_mode="HTML",
+                )
+                if candidate == photo:
+                    remember_file_id(bot_id, photo, msg)
+                return
+            except (TelegramError, BadRequest, Exception) as e:
+                if candidate == file_id:
+                    forget_media(bot_id, photo)
+                    continue
+                logger.warning(f"send_photo failed (url={photo_url!r}): {e} — falling back to text")
 
     # Fallback: send text only
     try:
@@ -65,10 +76,10 @@ async def _send_with_photo_fallback(context, chat_id, photo_url, text, reply_mar
 async def send_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         bot_id = context.bot_data.get("bot_id", "default")
-        welcome_text = get_config("welcome_text", bot_id, "👋 Welcome! Choose an option below.")
-        welcome_media_url = get_config("welcome_media_url", bot_id, "")
-        demo_url = sanitize_url(get_config("demo_button_url", bot_id, ""))
-        how_to_url = sanitize_url(get_config("how_to_use_button_url", bot_id, ""))
+        welcome_text = await get_config("welcome_text", bot_id, "👋 Welcome! Choose an option below.")
+        welcome_media_url = await get_config("welcome_media_url", bot_id, "")
+        demo_url = sanitize_url(await get_config("demo_button_url", bot_id, ""))
+        how_to_url = sanitize_url(await get_config("how_to_use_button_url", bot_id, ""))
 
         keyboard = [
             [InlineKeyboardButton("💎 Get Premium", callback_data="get_premium")],
@@ -94,13 +105,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     bot_id = context.bot_data.get("bot_id", "default")
     try:
-        supabase.table("bot_users").upsert({
-            "bot_id": bot_id,
-            "user_id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "updated_at": "now()"
-        }, on_conflict="bot_id, user_id").execute()
+        queue_user(bot_id, user.id, user.username, user.first_name)
     except Exception as e:
         logger.error(f"[{bot_id}] Failed to save user {user.id}: {e}")
     await send_welcome(update, context)
@@ -116,8 +121,8 @@ async def get_premium_callback(update: Update, context: ContextTypes.DEFAULT_TYP
 
     try:
         bot_id = context.bot_data.get("bot_id", "default")
-        premium_photo_url = get_config("premium_photo_url", bot_id, "")
-        premium_text = get_config("premium_text", bot_id, "🌟 <b>Get Premium Access!</b>\n\nChoose your payment method below.")
+        premium_photo_url = await get_config("premium_photo_url", bot_id, "")
+        premium_text = await get_config("premium_text", bot_id, "🌟 <b>Get Premium Access!</b>\n\nChoose your payment method below.")
 
         keyboard = [
             [InlineKeyboardButton("💳 PAY VIA UPI", callback_data="pay_upi")],
@@ -140,8 +145,8 @@ async def pay_upi_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         bot_id = context.bot_data.get("bot_id", "default")
-        upi_qr_url = get_config("upi_qr_url", bot_id, "")
-        upi_message = get_config("upi_message", bot_id, "💳 <b>Pay via UPI</b>\n\nScan the QR code above.")
+        upi_qr_url = await get_config("upi_qr_url", bot_id, "")
+        upi_message = await get_config("upi_message", bot_id, "💳 <b>Pay via UPI</b>\n\nScan the QR code above.")
 
         keyboard = [
             [InlineKeyboardButton("✅ I HAVE PAID", callback_data="paid_upi")],
@@ -163,8 +168,8 @@ async def pay_crypto_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     try:
         bot_id = context.bot_data.get("bot_id", "default")
-        crypto_qr_url = get_config("crypto_qr_url", bot_id, "")
-        crypto_message = get_config("crypto_message", bot_id, "₿ <b>Pay via Crypto</b>\n\nScan the QR code above.")
+        crypto_qr_url = await get_config("crypto_qr_url", bot_id, "")
+        crypto_message = await get_config("crypto_message", bot_id, "₿ <b>Pay via Crypto</b>\n\nScan the QR code above.")
 
         keyboard = [
             [InlineKeyboardButton("✅ I HAVE PAID", callback_data="paid_crypto")],
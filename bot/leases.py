@@ -0,0 +1,83 @@
+"""
+Per-bot polling leases (leader election across replicas).
+
+Only one process may long-poll a bot token; a second one gets Conflict. With
+LEADER_ELECTION=1, run_bot first takes the bot's row in `bot_leases` (see
+acquire_bot_lease in supabase_schema.sql) and renews it every
+LEASE_RENEW_INTERVAL seconds while polling. Other replicas retry on the same
+interval and take over as soon as the lease is released (clean shutdown,
+e.g. a rolling deploy) or expires after LEASE_TTL (crash).
+
+Off by default: a single deployment never needs it.
+"""
+import os
+import time
+import socket
+import uuid
+import asyncio
+import logging
+from bot.db import acquire_bot_lease, release_bot_lease
+
+logger = logging.getLogger(__name__)
+
+LEADER_ELECTION: bool = os.getenv("LEADER_ELECTION", "0").strip().lower() in ("1", "true", "yes", "on")
+LEASE_TTL: float = float(os.getenv("LEASE_TTL", "15"))
+LEASE_RENEW_INTERVAL: float = float(os.getenv("LEASE_RENEW_INTERVAL", "3"))
+
+# Unique per process, readable in the table
+HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LeaseLost(Exception):
+    pass
+
+
+async def wait_for_lease(bot_id: str):
+    """Block until this process holds the bot's lease."""
+    waiting = False
+    while True:
+        try:
+            if await asyncio.wait_for(acquire_bot_lease(bot_id, HOLDER_ID, LEASE_TTL),
+                                      LEASE_RENEW_INTERVAL):
+                if waiting:
+                    logger.info(f"[{bot_id}] Lease acquired — taking over polling.")
+                return
+        except asyncio.TimeoutError:
+            logger.warning(f"[{bot_id}] Lease acquire timed out")
+        except Exception as e:
+            logger.warning(f"[{bot_id}] Lease acquire failed: {e}")
+        if not waiting:
+            logger.info(f"[{bot_id}] Another replica holds the lease — standing by.")
+            waiting = True
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+
+
+async def hold_lease(bot_id: str):
+    """Renew the lease until it is lost; then raise LeaseLost.
+
+    Renewal errors (and renewals slower than LEASE_RENEW_INTERVAL) are
+    tolerated until the lease would have expired, since another replica may
+    take over from that moment; a hung request must not outlive the lease.
+    """
+    renewed_at = time.monotonic()
+    while True:
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+        try:
+            if not await asyncio.wait_for(acquire_bot_lease(bot_id, HOLDER_ID, LEASE_TTL),
+                                          LEASE_RENEW_INTERVAL):
+                raise LeaseLost(f"[{bot_id}] Lease taken by another replica")
+            renewed_at = time.monotonic()
+        except LeaseLost:
+            raise
+        except Exception as e:
+            # asyncio.TimeoutError has an empty message
+            logger.warning(f"[{bot_id}] Lease renew failed: {e!r}")
+            if time.monotonic() - renewed_at >= LEASE_TTL - LEASE_RENEW_INTERVAL:
+                raise LeaseLost(f"[{bot_id}] Lease could not be renewed before expiry")
+
+
+async def release_lease(bot_id: str):
+    try:
+        await release_bot_lease(bot_id, HOLDER_ID)
+    except Exception as e:
+        logger.warning(f"[{bot_id}] Lease release failed: {e}")
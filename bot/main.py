@@ -1,4 +1,8 @@
+import os
+import hmac
+import signal
 import asyncio
+import hashlib
 import logging
 from telegram import Update
 from telegram.error import Conflict, NetworkError, TimedOut
@@ -6,7 +10,9 @@ from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, ConversationHandler,
     MessageHandler, filters,
 )
-from bot.config import get_all_bot_tokens
+from bot.config import API_SECRET
+from bot.registry import bot_registry, BOT_REGISTRY_TTL
+from bot.supervisor import current_shard, heartbeat, shard_of
 from bot.handlers.premium import (
     start_command, get_premium_callback, pay_upi_callback,
     pay_crypto_callback, back_home_callback,
@@ -16,6 +22,15 @@ from bot.handlers.payment import (
     WAITING_SCREENSHOT_UPI, WAITING_SCREENSHOT_CRYPTO,
 )
 from bot.handlers.manage import build_manage_handler
+from bot.broadcast import resume_jobs, stop_jobs
+from bot.db import flush_users, watch_config_versions
+from bot.persistence import BOT_STATE_BACKEND, make_persistence
+from bot.leases import LEADER_ELECTION, wait_for_lease, hold_lease, release_lease
+from bot.restart import RestartPolicy
+from bot.updates import PerUserUpdateProcessor
+from bot.metrics import (
+    InstrumentedHTTPXRequest, instrument_handlers, record_error, sample_queue_depth,
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -23,23 +38,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# "polling": `python -m bot.main` long-polls every token (default).
+# "webhook": the FastAPI app (api/main.py) hosts every bot on /tg/{bot_id}/webhook.
+BOT_MODE: str = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_BASE_URL: str = (os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL") or "").rstrip("/")
+WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "") or API_SECRET
+
+# bot_id → running Application (webhook mode only)
+WEBHOOK_APPS: dict[str, Application] = {}
+# bot_id → (token, run_bot task) (polling mode only)
+POLLING_BOTS: dict[str, tuple[str, asyncio.Task]] = {}
+# bot_id → update-queue depth sampler task
+_queue_samplers: dict[str, asyncio.Task] = {}
+
 
 async def error_handler(update: object, context) -> None:
     """Global error handler — logs all errors, never crashes the bot."""
     err = context.error
     bot_id = context.bot_data.get("bot_id", "?") if context.bot_data else "?"
     if isinstance(err, Conflict):
+        record_error(bot_id, "conflict", err)
         logger.warning(f"[{bot_id}] Conflict: another instance polling. Will self-resolve...")
         return
     if isinstance(err, (NetworkError, TimedOut)):
+        record_error(bot_id, "network", err)
         logger.warning(f"[{bot_id}] Network issue: {err}. Auto-retrying...")
         return
+    record_error(bot_id, "handler", err)
     logger.error(f"[{bot_id}] Handler error: {err}", exc_info=err)
 
 
-def build_app(token: str, bot_id: str) -> Application:
+def _start_queue_sampler(app: Application, bot_id: str):
+    _stop_queue_sampler(bot_id)
+    _queue_samplers[bot_id] = asyncio.create_task(sample_queue_depth(app, bot_id))
+
+
+def _stop_queue_sampler(bot_id: str):
+    task = _queue_samplers.pop(bot_id, None)
+    if task:
+        task.cancel()
+
+
+def build_app(token: str, bot_id: str, webhook: bool = False) -> Application:
     """Build a fully configured Application for a single bot instance."""
-    app = Application.builder().token(token).build()
+    # Conversation states and user/chat data survive restarts (see bot/persistence.py)
+    builder = (Application.builder().token(token)
+               .persistence(make_persistence(bot_id))
+               .request(InstrumentedHTTPXRequest(bot_id, connection_pool_size=256))
+               .get_updates_request(InstrumentedHTTPXRequest(bot_id))
+               .concurrent_updates(PerUserUpdateProcessor()))
+    if webhook:
+        builder = builder.updater(None)  # updates arrive via api/main.py
+    app = builder.build()
     app.bot_data["bot_id"] = bot_id
     app.add_error_handler(error_handler)
 
@@ -57,6 +107,8 @@ def build_app(token: str, bot_id: str) -> Application:
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="payment",
+        persistent=True,
     )
 
     manage_conv = build_manage_handler()
@@ -69,48 +121,55 @@ def build_app(token: str, bot_id: str) -> Application:
     app.add_handler(CallbackQueryHandler(pay_crypto_callback,   pattern="^pay_crypto$"))
     app.add_handler(CallbackQueryHandler(back_home_callback,    pattern="^back_home$"))
 
+    instrument_handlers(app)
     return app
 
 
 async def run_bot(token: str, bot_id: str):
-    """Run a single bot with auto-restart on any crash."""
-    RETRY_DELAY = 15  # longer gap so old Render instance dies first
+    """Run a single bot, restarting it per RestartPolicy (bot/restart.py) on failure."""
+    policy = RestartPolicy(bot_id)
 
     while True:
         app = None
+        delay = 0.0
         try:
+            if LEADER_ELECTION:
+                await wait_for_lease(bot_id)
             logger.info(f"[{bot_id}] Starting...")
             app = build_app(token, bot_id)
             await app.initialize()
 
             # ── Delete any stale webhook / previous polling session ──────────
+            # With leases the previous leader stopped cleanly, so keep the
+            # updates that queued up during the hand-over.
             try:
-                await app.bot.delete_webhook(drop_pending_updates=True)
+                await app.bot.delete_webhook(drop_pending_updates=not LEADER_ELECTION)
                 logger.info(f"[{bot_id}] Webhook cleared.")
             except Exception as e:
                 logger.warning(f"[{bot_id}] delete_webhook failed (non-fatal): {e}")
 
             await app.start()
             await app.updater.start_polling(
-                drop_pending_updates=True,
+                drop_pending_updates=not LEADER_ELECTION,
                 allowed_updates=Update.ALL_TYPES,
             )
             logger.info(f"[{bot_id}] ✅ Running!")
-            await asyncio.Event().wait()
-
-        except Conflict:
-            logger.warning(f"[{bot_id}] Conflict — another instance running. Waiting {RETRY_DELAY}s...")
-            await asyncio.sleep(RETRY_DELAY)
-
-        except (NetworkError, TimedOut) as e:
-            logger.warning(f"[{bot_id}] Network error: {e}. Retrying in {RETRY_DELAY}s...")
-            await asyncio.sleep(RETRY_DELAY)
+            policy.running()
+            await resume_jobs(app)
+            _start_queue_sampler(app, bot_id)
+            if LEADER_ELECTION:
+                await hold_lease(bot_id)
+            else:
+                await asyncio.Event().wait()
 
         except Exception as e:
-            logger.error(f"[{bot_id}] Crash: {e}. Restarting in {RETRY_DELAY}s...")
-            await asyncio.sleep(RETRY_DELAY)
+            delay = policy.failed(e)
 
         finally:
+            # Also on cancellation / SIGTERM, which never reach policy.failed()
+            policy.stopped()
+            _stop_queue_sampler(bot_id)
+            await stop_jobs(bot_id)
             if app:
                 try:
                     if app.updater and app.updater.running:
@@ -120,18 +179,182 @@ async def run_bot(token: str, bot_id: str):
                     await app.shutdown()
                 except Exception:
                     pass
+            await flush_users()
+            if LEADER_ELECTION:
+                await release_lease(bot_id)
+
+        # Sleep with the Application stopped (and the lease released)
+        await asyncio.sleep(delay)
+
+
+# ── Webhook mode ──────────────────────────────────────────────────────────────
+
+def webhook_secret(bot_id: str) -> str:
+    """Per-bot secret Telegram echoes back in X-Telegram-Bot-Api-Secret-Token."""
+    return hmac.new(WEBHOOK_SECRET.encode(), bot_id.encode(), hashlib.sha256).hexdigest()
+
+
+def webhook_url(bot_id: str, base_url: str = "") -> str:
+    return f"{(base_url or WEBHOOK_BASE_URL).rstrip('/')}/tg/{bot_id}/webhook"
+
+
+async def _start_webhook_bot(bot_id: str, token: str, base_url: str):
+    app = None
+    try:
+        app = build_app(token, bot_id, webhook=True)
+        await app.initialize()
+        await app.bot.set_webhook(
+            url=webhook_url(bot_id, base_url),
+            secret_token=webhook_secret(bot_id),
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await app.start()
+        WEBHOOK_APPS[bot_id] = app
+        await resume_jobs(app)
+        _start_queue_sampler(app, bot_id)
+        logger.info(f"[{bot_id}] ✅ Webhook set: {webhook_url(bot_id, base_url)}")
+    except Exception as e:
+        logger.error(f"[{bot_id}] Webhook start failed: {e}")
+        if app:
+            try:
+                await app.shutdown()
+            except Exception:
+                pass
+
+
+async def _stop_webhook_bot(bot_id: str, delete_webhook: bool = False):
+    app = WEBHOOK_APPS.pop(bot_id, None)
+    if app is None:
+        return
+    _stop_queue_sampler(bot_id)
+    await stop_jobs(bot_id)
+    try:
+        if delete_webhook:
+            await app.bot.delete_webhook()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+    except Exception as e:
+        logger.warning(f"[{bot_id}] Shutdown error: {e}")
+
+
+async def sync_webhook_bots(base_url: str = "") -> dict[str, Application]:
+    """Start / stop webhook-mode bots so they match the bot registry."""
+    base_url = base_url or WEBHOOK_BASE_URL
+    if not base_url:
+        logger.error("Webhook mode needs WEBHOOK_BASE_URL (public https URL of the API).")
+        return WEBHOOK_APPS
+
+    try:
+        tokens = await asyncio.to_thread(bot_registry.refresh)
+    except Exception as e:
+        # Not "every bot was removed": keep serving until a read succeeds
+        logger.error(f"Bot registry refresh failed, keeping current bots: {e}")
+        return WEBHOOK_APPS
+    for bot_id, app in list(WEBHOOK_APPS.items()):
+        if tokens.get(bot_id) != app.bot.token:
+            logger.info(f"[{bot_id}] Removed, paused or re-tokened in the registry — stopping.")
+            # Paused / removed bots should stop receiving updates altogether
+            await _stop_webhook_bot(bot_id, delete_webhook=bot_id not in tokens)
+    for bot_id, token in tokens.items():
+        if bot_id not in WEBHOOK_APPS:
+            await _start_webhook_bot(bot_id, token, base_url)
+    return WEBHOOK_APPS
+
+
+async def start_webhook_bots(base_url: str = "") -> dict[str, Application]:
+    """Start every registered bot without an updater and point its webhook at the API."""
+    return await sync_webhook_bots(base_url)
+
+
+async def watch_webhook_bots(base_url: str = ""):
+    """Re-sync webhook bots with the registry every BOT_REGISTRY_TTL seconds."""
+    while True:
+        await asyncio.sleep(BOT_REGISTRY_TTL)
+        try:
+            await sync_webhook_bots(base_url)
+        except Exception as e:
+            logger.error(f"Bot registry sync failed: {e}")
+
+
+async def stop_webhook_bots():
+    """Stop webhook-mode bots. The webhook stays registered for the next replica."""
+    for bot_id in list(WEBHOOK_APPS):
+        await _stop_webhook_bot(bot_id)
+    await flush_users()
+
+
+async def run_registry(shard: tuple[int, int] | None = None):
+    """Polling mode: run one run_bot task per active bot, following the registry.
+
+    Bots added to the registry are started, and paused / removed ones are
+    stopped (their run_bot is cancelled and shuts down cleanly) within
+    BOT_REGISTRY_TTL seconds, without touching the other bots. Under the
+    supervisor (bot/supervisor.py) only the bots of this worker's shard run.
+    """
+    warned = False
+    try:
+        while True:
+            try:
+                tokens = await asyncio.to_thread(bot_registry.refresh)
+            except Exception as e:
+                logger.error(f"Bot registry refresh failed, keeping current bots: {e}")
+                tokens = {b: t for b, (t, _) in POLLING_BOTS.items()}
+            if shard:
+                tokens = {b: t for b, t in tokens.items() if shard_of(b, shard[1]) == shard[0]}
+
+            for bot_id, (token, task) in list(POLLING_BOTS.items()):
+                if tokens.get(bot_id) != token or task.done():
+                    logger.info(f"[{bot_id}] Removed, paused or re-tokened in the registry — stopping.")
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    del POLLING_BOTS[bot_id]
+            started = [b for b in tokens if b not in POLLING_BOTS]
+            for bot_id in started:
+                POLLING_BOTS[bot_id] = (tokens[bot_id], asyncio.create_task(run_bot(tokens[bot_id], bot_id)))
+            if started:
+                logger.info(f"Starting {len(started)} bot(s): {started} — {len(POLLING_BOTS)} running")
+
+            if not POLLING_BOTS and not warned:
+                if shard:
+                    logger.info(f"No bots hashed to shard {shard[0]}/{shard[1]} — idling.")
+                else:
+                    logger.error("No bots registered! Set BOT_TOKEN_1, BOT_TOKEN_2 etc. in env or add one via the API.")
+            warned = not POLLING_BOTS
+            await asyncio.sleep(BOT_REGISTRY_TTL)
+    finally:
+        # Shutdown (SIGTERM from the supervisor): stop every bot cleanly
+        tasks = [task for _, task in POLLING_BOTS.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        POLLING_BOTS.clear()
 
 
 async def main():
-    bot_tokens = get_all_bot_tokens()
-    if not bot_tokens:
-        logger.error("No bot tokens found! Set BOT_TOKEN_1, BOT_TOKEN_2 etc. in env.")
+    if BOT_MODE == "webhook":
+        logger.info("BOT_MODE=webhook — bots are served by the API process (api/main.py). Nothing to do.")
         return
 
-    logger.info(f"Starting {len(bot_tokens)} bot(s): {list(bot_tokens.keys())}")
-    await asyncio.gather(
-        *[run_bot(token, bot_id) for bot_id, token in bot_tokens.items()]
-    )
+    if LEADER_ELECTION and BOT_STATE_BACKEND != "supabase":
+        logger.warning("LEADER_ELECTION is on but BOT_STATE_BACKEND is not supabase: "
+                       "conversations in progress are lost when another replica takes a bot over.")
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    shard = current_shard()
+    beat = None
+    config_watch = asyncio.create_task(watch_config_versions())
+    if shard:
+        logger.info(f"Worker for shard {shard[0]}/{shard[1]}")
+        beat = asyncio.create_task(heartbeat(shard[0], lambda: POLLING_BOTS.keys()))
+    try:
+        await run_registry(shard)
+    except asyncio.CancelledError:
+        logger.info("Stopped.")
+    finally:
+        config_watch.cancel()
+        if beat:
+            beat.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+"""
+Telegram file_id cache for config photos stored as URLs.
+
+Photos set from the admin panel are Supabase Storage URLs, which Telegram
+re-downloads on every send_photo. After the first successful send we keep the
+file_id Telegram returned (per bot — file_ids are bot-scoped) and send that
+instead. Entries are keyed by the URL itself, so a new URL always misses; a
+config write to a media key also drops the old URL's entry.
+"""
+import threading
+
+# Config keys whose value is a photo (URL or Telegram file_id)
+MEDIA_KEYS = frozenset({"welcome_media_url", "premium_photo_url", "upi_qr_url", "crypto_qr_url"})
+
+# (bot_id, url) → file_id
+_file_ids: dict[tuple[str, str], str] = {}
+_lock = threading.Lock()
+
+
+def is_url(value: str | None) -> bool:
+    return bool(value) and value.startswith(("http://", "https://"))
+
+
+def cached_file_id(bot_id: str, url: str) -> str | None:
+    with _lock:
+        return _file_ids.get((bot_id, url))
+
+
+def remember_file_id(bot_id: str, url: str, message) -> None:
+    """Store the largest photo size Telegram returned for a URL send."""
+    if not is_url(url) or not message or not getattr(message, "photo", None):
+        return
+    with _lock:
+        _file_ids[(bot_id, url)] = message.photo[-1].file_id
+
+
+def forget_media(bot_id: str, url: str | None = None) -> None:
+    """Drop one URL's file_id, or every cached file_id for the bot."""
+    with _lock:
+        if url is not None:
+            _file_ids.pop((bot_id, url), None)
+        else:
+            for k in [k for k in _file_ids if k[0] == bot_id]:
+                del _file_ids[k]
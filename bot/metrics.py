@@ -0,0 +1,224 @@
+"""
+Prometheus metrics shared by the bot and API processes.
+
+Recorded:
+  - handler latency per bot / handler callback (instrument_handlers)
+  - Supabase request count + latency per table / RPC (instrument_supabase)
+  - Telegram Bot API latency per method (InstrumentedHTTPXRequest, telegram_http_hooks)
+  - errors by kind / exception type, as classified in bot.main.error_handler
+  - update queue depth per bot (sample_queue_depth)
+  - run_bot restarts, downtime and circuit state (bot/restart.py)
+  - API request latency per route (api/main.py middleware)
+
+Exposed on GET /metrics of the API app (bearer METRICS_TOKEN). start.sh runs the polling bot next to
+the API, so it sets PROMETHEUS_MULTIPROC_DIR and both processes write to it;
+render_metrics() then aggregates every process.
+"""
+import os
+import time
+import asyncio
+import logging
+import functools
+import weakref
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST,
+)
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR: str = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+QUEUE_SAMPLE_INTERVAL = 5
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Handler callback latency",
+    ["bot_id", "handler"],
+)
+BOT_ERRORS = Counter(
+    "bot_errors_total", "Errors seen by the bot error handler",
+    ["bot_id", "kind", "type"],
+)
+UPDATE_QUEUE_DEPTH = Gauge(
+    "bot_update_queue_depth", "Updates waiting in the Application update queue",
+    ["bot_id"], multiprocess_mode="livesum",
+)
+BOT_RESTARTS = Counter(
+    "bot_restarts_total", "run_bot restarts by error class (bot/restart.py)",
+    ["bot_id", "kind"],
+)
+BOT_DOWNTIME = Counter(
+    "bot_downtime_seconds_total", "Seconds a bot spent not polling between failure and restart",
+    ["bot_id"],
+)
+BOT_UP = Gauge(
+    "bot_up", "1 while the bot is polling",
+    ["bot_id"], multiprocess_mode="livesum",
+)
+BOT_CIRCUIT_OPEN = Gauge(
+    "bot_circuit_open", "1 while the bot's restart circuit breaker is open",
+    ["bot_id"], multiprocess_mode="livesum",
+)
+SUPABASE_SECONDS = Histogram(
+    "supabase_request_seconds", "Supabase (PostgREST) request latency",
+    ["table", "method", "status"],
+)
+TELEGRAM_SECONDS = Histogram(
+    "telegram_request_seconds", "Telegram Bot API request latency",
+    ["bot_id", "method", "status"],
+)
+API_SECONDS = Histogram(
+    "api_request_seconds", "Admin API request latency",
+    ["method", "route", "status"],
+)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """(body, content type) for the /metrics endpoint."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# ── Handlers ──────────────────────────────────────────────────────────────────
+
+def _timed(callback):
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            bot_id = context.bot_data.get("bot_id", "?") if context.bot_data else "?"
+            HANDLER_SECONDS.labels(bot_id, name).observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def _walk(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _walk(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from _walk(state_handlers)
+            yield from _walk(handler.fallbacks)
+        else:
+            yield handler
+
+
+def instrument_handlers(app):
+    """Time every registered handler callback, including inside conversations."""
+    seen = set()
+    for group in app.handlers.values():
+        for handler in _walk(group):
+            # The same handler object can sit in several conversation states
+            if id(handler) in seen:
+                continue
+            seen.add(id(handler))
+            handler.callback = _timed(handler.callback)
+
+
+def record_error(bot_id: str, kind: str, err: BaseException | None):
+    BOT_ERRORS.labels(bot_id, kind, type(err).__name__ if err else "None").inc()
+
+
+async def sample_queue_depth(app, bot_id: str):
+    """Publish the update queue size until cancelled."""
+    gauge = UPDATE_QUEUE_DEPTH.labels(bot_id)
+    try:
+        while True:
+            gauge.set(app.update_queue.qsize())
+            await asyncio.sleep(QUEUE_SAMPLE_INTERVAL)
+    finally:
+        gauge.set(0)
+
+
+# ── Telegram ──────────────────────────────────────────────────────────────────
+
+def _telegram_method(url: str) -> str:
+    if "/file/bot" in url:
+        return "file_download"
+    return url.rsplit("/", 1)[-1].split("?", 1)[0] or "?"
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that records latency per Bot API method."""
+
+    def __init__(self, bot_id: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._bot_id = bot_id
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        start = time.perf_counter()
+        status = "error"
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            status = str(code)
+            return code, payload
+        finally:
+            TELEGRAM_SECONDS.labels(self._bot_id, _telegram_method(url), status).observe(
+                time.perf_counter() - start)
+
+
+# ── Raw httpx clients (Supabase / direct Bot API calls) ───────────────────────
+
+# request → start time (requests are dropped once the response is done with)
+_started: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _supabase_table(path: str) -> str:
+    return path.split("/rest/v1/", 1)[-1] or "?"
+
+
+def _observe_supabase(response):
+    start = _started.pop(response.request, None)
+    if start is not None:
+        SUPABASE_SECONDS.labels(
+            _supabase_table(response.request.url.path), response.request.method,
+            str(response.status_code),
+        ).observe(time.perf_counter() - start)
+
+
+def _observe_telegram(response):
+    start = _started.pop(response.request, None)
+    if start is not None:
+        TELEGRAM_SECONDS.labels(
+            "api", _telegram_method(response.request.url.path), str(response.status_code),
+        ).observe(time.perf_counter() - start)
+
+
+def _mark(request):
+    _started[request] = time.perf_counter()
+
+
+async def _amark(request):
+    _mark(request)
+
+
+def _async_hook(fn):
+    async def hook(response):
+        fn(response)
+    return hook
+
+
+def instrument_supabase(client):
+    """Add timing hooks to a (sync or async) Supabase client's PostgREST session."""
+    try:
+        session = client.postgrest.session
+        if asyncio.iscoroutinefunction(getattr(session, "send", None)):
+            session.event_hooks = {"request": [_amark], "response": [_async_hook(_observe_supabase)]}
+        else:
+            session.event_hooks = {"request": [_mark], "response": [_observe_supabase]}
+    except Exception as e:
+        logger.warning(f"Supabase metrics not enabled: {e}")
+    return client
+
+
+def telegram_http_hooks() -> dict:
+    """event_hooks for an httpx.AsyncClient that calls the Bot API directly."""
+    return {"request": [_amark], "response": [_async_hook(_observe_telegram)]}
@@ -0,0 +1,96 @@
+"""
+Admin notifications for payment requests.
+
+New payment cards are fanned out to every admin in a background task with
+bounded concurrency. The (chat_id, message_id) of each card is saved on the
+payment row (`admin_messages`) so that when one admin approves or rejects,
+every other admin's card can be updated to show the outcome. A decision
+made while the fan-out is still running only sees the cards recorded so far,
+so notify_admins re-checks the payment once its cards are saved.
+"""
+import os
+import asyncio
+import logging
+from bot.db import get_payment, set_payment_admin_messages
+
+logger = logging.getLogger(__name__)
+
+ADMIN_NOTIFY_CONCURRENCY: int = int(os.getenv("ADMIN_NOTIFY_CONCURRENCY", "5"))
+
+
+def result_text(payment: dict) -> str:
+    """Card caption showing the outcome of a decided payment."""
+    label = "✅ <b>APPROVED</b>" if payment["status"] == "confirmed" else "❌ <b>REJECTED</b>"
+    return f"{label} — @{payment.get('username') or '?'} ({(payment.get('payment_type') or '?').upper()})"
+
+
+async def _send_card(bot, bot_id: str, chat_id: int, file_id: str, caption: str, kb) -> dict | None:
+    try:
+        msg = await bot.send_photo(
+            chat_id=chat_id,
+            photo=file_id,
+            caption=caption,
+            reply_markup=kb,
+            parse_mode="HTML",
+        )
+        return {"chat_id": chat_id, "message_id": msg.message_id, "photo": True}
+    except Exception as e:
+        logger.warning(f"[{bot_id}] Photo notify to {chat_id} failed: {e} — trying text")
+    try:
+        msg = await bot.send_message(
+            chat_id=chat_id,
+            text=caption,
+            reply_markup=kb,
+            parse_mode="HTML",
+        )
+        return {"chat_id": chat_id, "message_id": msg.message_id, "photo": False}
+    except Exception as e:
+        logger.error(f"[{bot_id}] Notify to admin {chat_id} completely failed: {e}")
+    return None
+
+
+async def notify_admins(bot, bot_id: str, admin_ids, payment_id: str,
+                        file_id: str, caption: str, kb) -> list[dict]:
+    """Send a payment card to every admin concurrently and record the message IDs."""
+    sem = asyncio.Semaphore(ADMIN_NOTIFY_CONCURRENCY)
+
+    async def _one(aid: int):
+        async with sem:
+            return await _send_card(bot, bot_id, aid, file_id, caption, kb)
+
+    sent = [m for m in await asyncio.gather(*(_one(aid) for aid in admin_ids)) if m]
+    try:
+        await set_payment_admin_messages(payment_id, sent)
+        # An admin may have decided from an early card before the rest were recorded
+        payment = await get_payment(payment_id)
+    except Exception as e:
+        logger.warning(f"[{bot_id}] Could not record admin cards for {payment_id}: {e}")
+        return sent
+    if payment and payment.get("status") != "pending":
+        await update_admin_cards(bot, {**payment, "admin_messages": sent}, result_text(payment))
+    return sent
+
+
+async def update_admin_cards(bot, payment: dict, text: str, skip: tuple[int, int] | None = None):
+    """Replace every recorded admin card for a payment with `text` (buttons removed)."""
+    sem = asyncio.Semaphore(ADMIN_NOTIFY_CONCURRENCY)
+
+    async def _one(card: dict):
+        if skip and (card.get("chat_id"), card.get("message_id")) == skip:
+            return
+        async with sem:
+            try:
+                if card.get("photo"):
+                    await bot.edit_message_caption(
+                        chat_id=card["chat_id"], message_id=card["message_id"],
+                        caption=text, parse_mode="HTML", reply_markup=None,
+                    )
+                else:
+                    await bot.edit_message_text(
+                        chat_id=card["chat_id"], message_id=card["message_id"],
+                        text=text, parse_mode="HTML", reply_markup=None,
+                    )
+            except Exception as e:
+                logger.debug(f"Admin card {card} not updated: {e}")
+
+    await asyncio.gather(*(_one(c) for c in payment.get("admin_messages") or []))
@@ -0,0 +1,121 @@
+"""
+Payment decisions shared by the /manage callbacks and the admin API.
+
+Approving or rejecting is a single conditional update (pending → confirmed /
+rejected, returning the row), so when two admins act at once exactly one of
+them wins. Only the winner notifies the user and updates the other admins'
+cards; repeating the same decision is a no-op, a conflicting one is refused.
+
+Bulk decisions use one set-based update and fan the user notifications out
+through the bot's broadcast rate limiter.
+"""
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from bot.db import get_config, get_payment, transition_payment, transition_payments
+from bot.notify import update_admin_cards, result_text
+from bot.broadcast import BROADCAST_CONCURRENCY, get_limiter, send_limited
+
+logger = logging.getLogger(__name__)
+
+DECISIONS = ("confirmed", "rejected")
+
+DEFAULT_CONFIRMED_MESSAGE = (
+    "🎉 <b>Payment Confirmed!</b>\n\n"
+    "Your premium access has been activated. Thank you! 🙏"
+)
+REJECTED_MESSAGE = (
+    "❌ <b>Payment Rejected</b>\n\n"
+    "Unfortunately, we could not verify your payment screenshot.\n"
+    "Please send a clear screenshot of the successful transaction.\n"
+    "If you believe this is a mistake, contact support.\n"
+    "Try again with /start. 🙏"
+)
+
+
+class PaymentNotFound(Exception):
+    pass
+
+
+class PaymentAlreadyDecided(Exception):
+    """The payment was already moved to a different status."""
+
+    def __init__(self, payment: dict):
+        super().__init__(f"Payment already {payment.get('status')}")
+        self.payment = payment
+
+
+async def decide_payment(payment_id: str, status: str) -> tuple[dict, bool]:
+    """Move a pending payment to `status`. Returns (payment, changed).
+
+    `changed` is False when the payment already had this status (idempotent
+    retry or double tap). Raises PaymentAlreadyDecided if it has the other one.
+    """
+    if status not in DECISIONS:
+        raise ValueError(f"Invalid status: {status}")
+    payment = await transition_payment(payment_id, status)
+    if payment:
+        return payment, True
+    # Lost the race (or a retry): only now is the extra read needed
+    current = await get_payment(payment_id)
+    if not current:
+        raise PaymentNotFound(payment_id)
+    if current["status"] == status:
+        return current, False
+    raise PaymentAlreadyDecided(current)
+
+
+async def _join_keyboard(bot_id: str) -> InlineKeyboardMarkup | None:
+    join_url = (await get_config("join_link", bot_id, "") or "").strip()
+    # Normalize @username -> https://t.me/username
+    if join_url.startswith("@"):
+        join_url = f"https://t.me/{join_url[1:]}"
+    elif join_url and not join_url.startswith(("http://", "https://")):
+        join_url = f"https://{join_url}"
+    if not join_url:
+        return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔗 Join Now", url=join_url)]])
+
+
+async def _user_message(payment: dict) -> tuple[str, InlineKeyboardMarkup | None]:
+    if payment["status"] != "confirmed":
+        return REJECTED_MESSAGE, None
+    bot_id = payment.get("bot_id", "default")
+    text = await get_config("payment_confirmed_message", bot_id, "") or DEFAULT_CONFIRMED_MESSAGE
+    return text, await _join_keyboard(bot_id)
+
+
+async def notify_user(bot, payment: dict):
+    """Tell the user the outcome (with the join button when confirmed)."""
+    bot_id = payment.get("bot_id", "default")
+    text, kb = await _user_message(payment)
+    result = await send_limited(bot, get_limiter(bot_id), payment["user_id"],
+                                text=text, reply_markup=kb, parse_mode="HTML")
+    if result != "sent":
+        logger.warning(f"[{bot_id}] Could not notify user {payment['user_id']}: {result}")
+
+
+async def announce_decision(bot, payment: dict, skip: tuple[int, int] | None = None):
+    """Winner-only side effects: notify the user and update every admin card."""
+    await asyncio.gather(
+        notify_user(bot, payment),
+        update_admin_cards(bot, payment, result_text(payment), skip=skip),
+    )
+
+
+async def decide_payments(payment_ids: list[str], status: str, bot_id: str | None = None) -> list[dict]:
+    """Move many pending payments to `status` in one update; returns the ones moved."""
+    if status not in DECISIONS:
+        raise ValueError(f"Invalid status: {status}")
+    return await transition_payments(list(dict.fromkeys(payment_ids)), status, bot_id)
+
+
+async def announce_decisions(bot, payments: list[dict]):
+    """announce_decision for a batch, BROADCAST_CONCURRENCY at a time."""
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def _one(payment: dict):
+        async with sem:
+            await announce_decision(bot, payment)
+
+    await asyncio.gather(*(_one(p) for p in payments))
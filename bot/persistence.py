@@ -0,0 +1,268 @@
+"""
+Persistence for conversation states, user_data and chat_data.
+
+Without it every restart of run_bot forgets that a user is mid-way through the
+payment flow (or an admin mid-way through /manage), and their next message
+falls through. PTB already batches persistence: it collects dirty
+conversations / user_data / chat_data and calls the update_* methods once per
+`update_interval` (PERSISTENCE_FLUSH_INTERVAL). Those calls only stage rows in
+memory here; one background write then commits the whole batch off the event
+loop. Application.stop() triggers a final batch and flush(), so graceful
+restarts lose nothing.
+
+Where the state lives (BOT_STATE_BACKEND):
+  - sqlite (default): a file local to the process (BOT_STATE_DB). It only
+    survives a restart inside the same container.
+  - supabase: the shared `bot_state` table. Required with LEADER_ELECTION, so
+    the replica that takes a bot over starts from the state the previous
+    leader flushed when it let go.
+
+PTB reads persisted state once, when an Application initialises, and works
+from memory afterwards. So neither store makes it safe for two processes to
+serve the same bot at the same time (e.g. webhook mode with several API
+replicas behind a load balancer): run webhook mode as a single replica.
+
+Rows are keyed by bot_id. bot_data is not persisted (build_app sets it), nor
+is callback_data.
+"""
+import os
+import json
+import asyncio
+import logging
+import sqlite3
+import threading
+from telegram.ext import BasePersistence, PersistenceInput
+from bot.config import supabase
+
+logger = logging.getLogger(__name__)
+
+BOT_STATE_BACKEND: str = os.getenv("BOT_STATE_BACKEND", "sqlite").strip().lower()
+BOT_STATE_DB: str = os.getenv("BOT_STATE_DB", "bot_state.sqlite3")
+PERSISTENCE_FLUSH_INTERVAL: float = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "5"))
+# Rows per read of `bot_state` (PostgREST max-rows on Supabase is 1000)
+STATE_PAGE_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+  bot_id TEXT NOT NULL, name TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL,
+  PRIMARY KEY (bot_id, name, key)
+);
+CREATE TABLE IF NOT EXISTS user_data (
+  bot_id TEXT NOT NULL, id INTEGER NOT NULL, data TEXT NOT NULL,
+  PRIMARY KEY (bot_id, id)
+);
+CREATE TABLE IF NOT EXISTS chat_data (
+  bot_id TEXT NOT NULL, id INTEGER NOT NULL, data TEXT NOT NULL,
+  PRIMARY KEY (bot_id, id)
+);
+"""
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class BatchedPersistence(BasePersistence):
+    """BasePersistence that commits each persistence cycle as one batch.
+
+    Subclasses supply the store through _load / _commit / _close, which block
+    and are run in a worker thread.
+    """
+
+    def __init__(self, bot_id: str, update_interval: float = PERSISTENCE_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.bot_id = bot_id
+        # (table, key) → row value, or None to delete the row
+        self._pending: dict[tuple[str, str | int], str | None] = {}
+        self._write_task: asyncio.Task | None = None
+        self._write_lock = asyncio.Lock()
+
+    # ── Store ─────────────────────────────────────────────────────────────────
+
+    def _load(self, table: str, name: str | None = None) -> list[tuple]:
+        """(key, json) rows of a table; for conversations, of conversation `name`."""
+        raise NotImplementedError
+
+    def _commit(self, pending: dict):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    # ── Write batching ────────────────────────────────────────────────────────
+
+    def _stage(self, table: str, key, value: str | None):
+        self._pending[(table, key)] = value
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_soon())
+
+    async def _write_soon(self):
+        # Let the rest of this persistence cycle stage its rows first
+        await asyncio.sleep(0)
+        await self._write()
+
+    async def _write(self):
+        async with self._write_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                await asyncio.to_thread(self._commit, pending)
+            except Exception as e:
+                logger.error(f"[{self.bot_id}] Persistence write failed: {e}")
+                # Keep the rows for the next cycle unless newer values arrived
+                for k, v in pending.items():
+                    self._pending.setdefault(k, v)
+
+    # ── BasePersistence ───────────────────────────────────────────────────────
+
+    async def get_user_data(self) -> dict[int, dict]:
+        rows = await asyncio.to_thread(self._load, "user_data")
+        return {uid: json.loads(data) for uid, data in rows}
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        rows = await asyncio.to_thread(self._load, "chat_data")
+        return {cid: json.loads(data) for cid, data in rows}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await asyncio.to_thread(self._load, "conversations", name)
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        self._stage("conversations", (name, _dumps(list(key))),
+                    None if new_state is None else _dumps(new_state))
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage("user_data", user_id, _dumps(data) if data else None)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._stage("chat_data", chat_id, _dumps(data) if data else None)
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage("user_data", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage("chat_data", chat_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._write_task is not None:
+            await asyncio.gather(self._write_task, return_exceptions=True)
+        await self._write()
+        await asyncio.to_thread(self._close)
+
+
+class SQLitePersistence(BatchedPersistence):
+    """State in a local SQLite file (one file for every bot in the process)."""
+
+    def __init__(self, bot_id: str, path: str = BOT_STATE_DB,
+                 update_interval: float = PERSISTENCE_FLUSH_INTERVAL):
+        super().__init__(bot_id, update_interval)
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _select(self, sql: str, *args) -> list[tuple]:
+        with self._db_lock:
+            return self._db().execute(sql, (self.bot_id, *args)).fetchall()
+
+    def _load(self, table: str, name: str | None = None) -> list[tuple]:
+        if table == "conversations":
+            return self._select("SELECT key, state FROM conversations WHERE bot_id=? AND name=?", name)
+        return self._select(f"SELECT id, data FROM {table} WHERE bot_id=?")
+
+    def _commit(self, pending: dict):
+        with self._db_lock:
+            db = self._db()
+            with db:
+                for (table, key), value in pending.items():
+                    if table == "conversations":
+                        name, key = key
+                        if value is None:
+                            db.execute("DELETE FROM conversations WHERE bot_id=? AND name=? AND key=?",
+                                       (self.bot_id, name, key))
+                        else:
+                            db.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)",
+                                       (self.bot_id, name, key, value))
+                    elif value is None:
+                        db.execute(f"DELETE FROM {table} WHERE bot_id=? AND id=?", (self.bot_id, key))
+                    else:
+                        db.execute(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)",
+                                   (self.bot_id, key, value))
+
+    def _close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SupabasePersistence(BatchedPersistence):
+    """State in the shared `bot_state` table, readable by whichever replica
+    polls the bot next.
+
+    Removed entries are written with NULL data instead of being deleted, so
+    each cycle is a single bulk upsert.
+    """
+
+    def _load(self, table: str, name: str | None = None) -> list[tuple]:
+        rows, start = [], 0
+        while True:
+            page = (supabase.table("bot_state").select("key, data")
+                    .eq("bot_id", self.bot_id).eq("kind", table).eq("name", name or "")
+                    .not_.is_("data", "null")
+                    .order("key").range(start, start + STATE_PAGE_SIZE - 1)
+                    .execute().data or [])
+            rows += [(r["key"] if table == "conversations" else int(r["key"]), r["data"])
+                     for r in page]
+            if len(page) < STATE_PAGE_SIZE:
+                return rows
+            start += STATE_PAGE_SIZE
+
+    def _commit(self, pending: dict):
+        rows = []
+        for (table, key), value in pending.items():
+            # user_data / chat_data rows have no conversation name
+            name, key = key if table == "conversations" else ("", str(key))
+            rows.append({"bot_id": self.bot_id, "kind": table, "name": name,
+                         "key": key, "data": value})
+        supabase.table("bot_state").upsert(rows, on_conflict="bot_id,kind,name,key").execute()
+
+
+def make_persistence(bot_id: str) -> BatchedPersistence:
+    """Persistence for one bot's Application, as selected by BOT_STATE_BACKEND."""
+    if BOT_STATE_BACKEND == "supabase":
+        return SupabasePersistence(bot_id)
+    return SQLitePersistence(bot_id)
@@ -0,0 +1,143 @@
+"""
+Bot registry — which bots run, shared by the bot runner and the API.
+
+Bots come from two places:
+  - env vars (BOT_TOKEN / BOT_TOKEN_<n>, see bot.config.get_all_bot_tokens)
+  - the `bots` table, editable at runtime through the API
+
+A `bots` row overrides the env entry with the same bot_id: it can supply a
+new token, or pause the bot (status = 'paused'). A row with a NULL token
+only carries the status of an env-defined bot. Deleting a row of an
+env-defined bot brings back its env settings, so such a bot can be paused
+but not removed.
+
+`bot_registry` is a read-only mapping {bot_id: token} of *active* bots,
+re-read off the event loop every BOT_REGISTRY_TTL seconds. The polling
+runner and the webhook host reconcile their running Applications against it on the same
+interval, so registry changes start and stop bots without a restart.
+"""
+import os
+import asyncio
+import logging
+import datetime
+import threading
+from collections.abc import Mapping
+from postgrest.exceptions import APIError
+from bot.config import supabase, get_all_bot_tokens
+
+logger = logging.getLogger(__name__)
+
+BOT_REGISTRY_TTL: float = float(os.getenv("BOT_REGISTRY_TTL", "30"))
+BOT_STATUSES = ("active", "paused")
+# Postgres undefined_table, and PostgREST's "table not in the schema cache"
+_MISSING_TABLE_CODES = ("42P01", "PGRST205")
+
+
+def load_registry_rows() -> list[dict]:
+    """All `bots` rows ([] if the table does not exist yet).
+
+    Any other error is raised: treating a failed read as an empty table
+    would stop every table-defined bot and resume paused env bots.
+    """
+    try:
+        res = supabase.table("bots").select("bot_id,token,status").execute()
+        return res.data or []
+    except APIError as e:
+        if e.code not in _MISSING_TABLE_CODES:
+            raise
+        logger.warning(f"Bot registry table missing, using env bots only: {e.message}")
+        return []
+
+
+def resolve_bots(rows: list[dict]) -> dict[str, dict]:
+    """bot_id → {token, status, source} from env bots overlaid with table rows."""
+    bots = {bot_id: {"token": token, "status": "active", "source": "env"}
+            for bot_id, token in get_all_bot_tokens().items()}
+    for row in rows:
+        bot = bots.setdefault(row["bot_id"], {"token": "", "status": "active", "source": "table"})
+        if row.get("token"):
+            bot["token"] = row["token"]
+        bot["status"] = row.get("status") or "active"
+    return bots
+
+
+class BotRegistry(Mapping):
+    """{bot_id: token} of active bots, from the last refresh().
+
+    Lookups never do I/O (they run inside async routes and handlers): the
+    snapshot is replaced by refresh(), called off the event loop by
+    keep_fresh() or by the runners' own reconcile loops.
+    """
+
+    def __init__(self, ttl: float = BOT_REGISTRY_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._bots: dict[str, dict] = {}
+        self._tokens: dict[str, str] = {}
+
+    def refresh(self) -> dict[str, str]:
+        """Re-read env + `bots` table (blocking — call via asyncio.to_thread).
+
+        Raises if the table cannot be read; the previous snapshot stays in place.
+        """
+        bots = resolve_bots(load_registry_rows())
+        tokens = {b: v["token"] for b, v in bots.items() if v["status"] == "active" and v["token"]}
+        with self._lock:
+            self._bots, self._tokens = bots, tokens
+        return tokens
+
+    async def keep_fresh(self):
+        """Refresh every `ttl` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Bot registry refresh failed: {e}")
+
+    def bots(self) -> dict[str, dict]:
+        """Every known bot, paused ones included (tokens not exposed)."""
+        return {b: {"status": v["status"], "source": v["source"]} for b, v in self._bots.items()}
+
+    def __getitem__(self, bot_id: str) -> str:
+        return self._tokens[bot_id]
+
+    def __iter__(self):
+        return iter(dict(self._tokens))
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+
+bot_registry = BotRegistry()
+
+
+# ── Writes (API) ──────────────────────────────────────────────────────────────
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def register_bot(bot_id: str, token: str, status: str = "active"):
+    supabase.table("bots").upsert({
+        "bot_id": bot_id,
+        "token": token,
+        "status": status,
+        "updated_at": _now(),
+    }, on_conflict="bot_id").execute()
+    bot_registry.refresh()
+
+
+def set_bot_status(bot_id: str, status: str):
+    """Pause / resume a bot (env-defined bots get a token-less override row)."""
+    supabase.table("bots").upsert({
+        "bot_id": bot_id,
+        "status": status,
+        "updated_at": _now(),
+    }, on_conflict="bot_id").execute()
+    bot_registry.refresh()
+
+
+def unregister_bot(bot_id: str):
+    supabase.table("bots").delete().eq("bot_id", bot_id).execute()
+    bot_registry.refresh()
@@ -0,0 +1,122 @@
+"""
+Restart policy for run_bot.
+
+Each failure is classified (conflict / network / auth / crash / lease) and
+waits a jittered exponential backoff for its class before the Application is
+rebuilt: a network blip retries in about a second, while a revoked token backs
+off for minutes. The attempt counters reset once the bot has been up for
+BOT_STABLE_AFTER seconds.
+
+After BOT_CIRCUIT_THRESHOLD consecutive failures the circuit opens and the bot
+is left down for BOT_CIRCUIT_COOLDOWN seconds. The next start is a single
+probe: if it fails again the circuit reopens straight away.
+
+Restarts, downtime and circuit state are exported through bot.metrics.
+"""
+import os
+import time
+import random
+import logging
+from telegram.error import Conflict, InvalidToken, NetworkError
+from bot.leases import LeaseLost
+from bot.metrics import BOT_RESTARTS, BOT_DOWNTIME, BOT_UP, BOT_CIRCUIT_OPEN
+
+logger = logging.getLogger(__name__)
+
+BOT_CIRCUIT_THRESHOLD: int = int(os.getenv("BOT_CIRCUIT_THRESHOLD", "8"))
+BOT_CIRCUIT_COOLDOWN: float = float(os.getenv("BOT_CIRCUIT_COOLDOWN", "600"))
+BOT_STABLE_AFTER: float = float(os.getenv("BOT_STABLE_AFTER", "60"))
+
+
+class Backoff:
+    """Exponential backoff from `base` up to `cap` seconds, with equal jitter."""
+
+    def __init__(self, base: float, cap: float, counts: bool = True):
+        self.base = base
+        self.cap = cap
+        # False: not a failure of the bot (no circuit / downtime accounting)
+        self.counts = counts
+
+    def delay(self, attempt: int) -> float:
+        ceiling = min(self.cap, self.base * 2 ** max(attempt - 1, 0))
+        # Half fixed, half random: never a tight loop, never in lock-step
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+POLICIES: dict[str, Backoff] = {
+    # Another poller (usually the previous deploy) still holds the token
+    "conflict": Backoff(5, 60),
+    "network":  Backoff(1, 30),
+    # Token revoked / wrong: retrying fast cannot help
+    "auth":     Backoff(60, 900),
+    "crash":    Backoff(2, 120),
+    # Leadership moved to another replica; wait_for_lease does the waiting
+    "lease":    Backoff(0, 0, counts=False),
+}
+
+
+def classify(err: BaseException) -> str:
+    if isinstance(err, LeaseLost):
+        return "lease"
+    if isinstance(err, Conflict):
+        return "conflict"
+    if isinstance(err, InvalidToken):
+        return "auth"
+    if isinstance(err, NetworkError):  # includes TimedOut
+        return "network"
+    return "crash"
+
+
+class RestartPolicy:
+    """Tracks one bot's failures and decides how long to wait before restarting."""
+
+    def __init__(self, bot_id: str):
+        self.bot_id = bot_id
+        self.failures = 0                    # consecutive, for the circuit breaker
+        self.attempts: dict[str, int] = {}   # consecutive, per error class
+        self.up_since: float | None = None
+        self.down_since: float | None = time.monotonic()
+
+    def running(self):
+        """The bot is polling again."""
+        now = time.monotonic()
+        if self.down_since is not None:
+            BOT_DOWNTIME.labels(self.bot_id).inc(now - self.down_since)
+            self.down_since = None
+        self.up_since = now
+        BOT_UP.labels(self.bot_id).set(1)
+        BOT_CIRCUIT_OPEN.labels(self.bot_id).set(0)
+
+    def stopped(self):
+        """The bot stopped polling, for whatever reason (failure, cancel, shutdown)."""
+        BOT_UP.labels(self.bot_id).set(0)
+
+    def failed(self, err: BaseException) -> float:
+        """Record a failure; returns the seconds to wait before restarting."""
+        now = time.monotonic()
+        kind = classify(err)
+        policy = POLICIES[kind]
+        if self.up_since is not None and now - self.up_since >= BOT_STABLE_AFTER:
+            self.failures = 0
+            self.attempts.clear()
+        self.up_since = None
+        BOT_UP.labels(self.bot_id).set(0)
+        BOT_RESTARTS.labels(self.bot_id, kind).inc()
+        if not policy.counts:
+            logger.info(f"[{self.bot_id}] {err}")
+            return 0.0
+
+        if self.down_since is None:
+            self.down_since = now
+        self.failures += 1
+        self.attempts[kind] = self.attempts.get(kind, 0) + 1
+        delay = policy.delay(self.attempts[kind])
+        if self.failures >= BOT_CIRCUIT_THRESHOLD:
+            delay = max(delay, BOT_CIRCUIT_COOLDOWN)
+            BOT_CIRCUIT_OPEN.labels(self.bot_id).set(1)
+            logger.error(f"[{self.bot_id}] {self.failures} failures in a row (last: {kind}: {err}) — "
+                         f"circuit open, next attempt in {delay:.0f}s")
+        else:
+            logger.warning(f"[{self.bot_id}] {kind} error: {err}. "
+                           f"Restart {self.failures} in {delay:.1f}s")
+        return delay
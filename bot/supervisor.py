@@ -0,0 +1,219 @@
+"""
+Multi-process bot runner.
+
+`python -m bot.supervisor` starts BOT_WORKERS worker processes (default: one
+per available CPU core), each running `python -m bot.main` for a shard of the
+registry. A bot belongs to the shard with the highest rendezvous hash of
+(shard, bot_id), so every worker independently agrees on ownership without
+coordination, and changing the worker count only moves the bots whose top
+shard changed.
+
+The supervisor restarts a worker that exits, or that stops writing its
+heartbeat for BOT_WORKER_STALE seconds, without touching the others. Worker
+health is written to BOT_HEALTH_DIR/supervisor.json (served by the API on
+GET /workers).
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+BOT_HEALTH_DIR: str = os.getenv("BOT_HEALTH_DIR", "/tmp/bot-health")
+BOT_WORKER_STALE: float = float(os.getenv("BOT_WORKER_STALE", "120"))
+HEARTBEAT_INTERVAL = 10
+WORKER_RESTART_DELAY = 5
+
+# Set by the supervisor for each worker process
+SHARD_INDEX_ENV = "BOT_SHARD_INDEX"
+SHARD_COUNT_ENV = "BOT_SHARD_COUNT"
+
+
+def worker_count() -> int:
+    configured = int(os.getenv("BOT_WORKERS", "0") or 0)
+    if configured > 0:
+        return configured
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+def shard_of(bot_id: str, shards: int) -> int:
+    """Rendezvous (highest random weight) hash of bot_id over `shards` workers."""
+    if shards <= 1:
+        return 0
+    return max(range(shards),
+               key=lambda s: hashlib.sha256(f"{s}:{bot_id}".encode()).digest())
+
+
+def current_shard() -> tuple[int, int] | None:
+    """(index, count) when running as a supervisor worker, else None."""
+    if SHARD_COUNT_ENV not in os.environ:
+        return None
+    return int(os.environ[SHARD_INDEX_ENV]), int(os.environ[SHARD_COUNT_ENV])
+
+
+def _heartbeat_path(index: int) -> str:
+    return os.path.join(BOT_HEALTH_DIR, f"worker-{index}.json")
+
+
+def _write_json(path: str, data: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+async def heartbeat(index: int, bots_fn):
+    """Worker side: report liveness and owned bots every HEARTBEAT_INTERVAL seconds."""
+    os.makedirs(BOT_HEALTH_DIR, exist_ok=True)
+    while True:
+        try:
+            _write_json(_heartbeat_path(index), {
+                "pid": os.getpid(), "at": time.time(), "bots": sorted(bots_fn()),
+            })
+        except OSError as e:
+            logger.warning(f"Heartbeat write failed: {e}")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def read_health() -> dict | None:
+    """The supervisor's last health report, or None if no supervisor runs."""
+    try:
+        with open(os.path.join(BOT_HEALTH_DIR, "supervisor.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Worker:
+    def __init__(self, index: int, count: int):
+        self.index = index
+        self.count = count
+        self.proc: asyncio.subprocess.Process | None = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.last_exit: int | None = None
+
+    async def start(self):
+        try:
+            os.remove(_heartbeat_path(self.index))
+        except OSError:
+            pass
+        env = {**os.environ, SHARD_INDEX_ENV: str(self.index), SHARD_COUNT_ENV: str(self.count)}
+        self.proc = await asyncio.create_subprocess_exec(sys.executable, "-m", "bot.main", env=env)
+        self.started_at = time.time()
+        logger.info(f"Worker {self.index}/{self.count} started (pid {self.proc.pid})")
+
+    def heartbeat(self) -> dict:
+        try:
+            with open(_heartbeat_path(self.index)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def stale(self) -> bool:
+        # A fresh worker gets BOT_WORKER_STALE seconds to write its first beat
+        last = self.heartbeat().get("at") or self.started_at
+        return time.time() - last > BOT_WORKER_STALE
+
+    def health(self) -> dict:
+        beat = self.heartbeat()
+        alive = self.proc is not None and self.proc.returncode is None
+        return {
+            "shard": self.index,
+            "pid": self.proc.pid if self.proc else None,
+            "status": "ok" if alive and not self.stale() else ("stale" if alive else "down"),
+            "started_at": self.started_at,
+            "last_heartbeat": beat.get("at"),
+            "bots": beat.get("bots", []),
+            "restarts": self.restarts,
+            "last_exit": self.last_exit,
+        }
+
+    async def run(self, stopping: asyncio.Event):
+        """Keep this worker running until the supervisor stops."""
+        while not stopping.is_set():
+            await self.start()
+            while self.proc.returncode is None and not stopping.is_set():
+                try:
+                    await asyncio.wait_for(self.proc.wait(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if self.stale():
+                        logger.error(f"Worker {self.index} heartbeat is stale — killing pid {self.proc.pid}")
+                        self.proc.kill()
+            if stopping.is_set():
+                break
+            self.last_exit = self.proc.returncode
+            _mark_dead(self.proc.pid)
+            self.restarts += 1
+            logger.error(f"Worker {self.index} exited with {self.last_exit}; "
+                         f"restarting in {WORKER_RESTART_DELAY}s")
+            try:
+                await asyncio.wait_for(stopping.wait(), WORKER_RESTART_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        if self.proc is None or self.proc.returncode is not None:
+            return
+        self.proc.terminate()
+        try:
+            await asyncio.wait_for(self.proc.wait(), 30)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+            await self.proc.wait()
+        _mark_dead(self.proc.pid)
+
+
+def _mark_dead(pid: int):
+    """Drop a dead worker's live gauges from the shared Prometheus directory."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        try:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+        except Exception:
+            pass
+
+
+async def supervise():
+    count = worker_count()
+    os.makedirs(BOT_HEALTH_DIR, exist_ok=True)
+    workers = [Worker(i, count) for i in range(count)]
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    logger.info(f"Supervisor starting {count} bot worker(s)")
+    runners = [asyncio.create_task(w.run(stopping)) for w in workers]
+    while not stopping.is_set():
+        _write_json(os.path.join(BOT_HEALTH_DIR, "supervisor.json"), {
+            "pid": os.getpid(), "at": time.time(), "workers": [w.health() for w in workers],
+        })
+        try:
+            await asyncio.wait_for(stopping.wait(), HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    logger.info("Supervisor stopping workers...")
+    await asyncio.gather(*(w.stop() for w in workers))
+    await asyncio.gather(*runners, return_exceptions=True)
+    try:
+        os.remove(os.path.join(BOT_HEALTH_DIR, "supervisor.json"))
+    except OSError:
+        pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    asyncio.run(supervise())
@@ -0,0 +1,59 @@
+"""
+Concurrent update processing with per-(chat, user) ordering.
+
+By default an Application handles one update at a time, so one user's slow
+Supabase insert holds up every other user's button taps. PerUserUpdateProcessor
+runs updates concurrently (at most UPDATE_CONCURRENCY at once) but serialises
+updates from the same (chat_id, user_id): ConversationHandler state and
+user_data are only ever touched by one update of that user at a time, in the
+order Telegram delivered them.
+
+An update waits for its user's lock *before* taking a concurrency slot, so a
+user flooding the bot queues behind themselves instead of occupying slots.
+"""
+import os
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+UPDATE_CONCURRENCY: int = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = UPDATE_CONCURRENCY):
+        super().__init__(max_concurrent_updates)
+        # (chat_id, user_id) → [lock, updates holding or waiting for it]
+        self._locks: dict[tuple, list] = {}
+
+    @staticmethod
+    def _key(update: object) -> tuple | None:
+        if not isinstance(update, Update):
+            return None
+        chat, user = update.effective_chat, update.effective_user
+        if chat is None and user is None:
+            return None
+        return (chat.id if chat else None, user.id if user else None)
+
+    async def process_update(self, update, coroutine) -> None:
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(key, None)
+
+    async def do_process_update(self, update, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -1,10 +1,39 @@
 #!/bin/bash
-# Start Telegram bot in background (non-blocking)
-python -m bot.main &
-BOT_PID=$!
+# Bot and API processes share Prometheus metrics through this directory
+# (served on the API's /metrics). Cleared on every start.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-multiproc}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 
-echo "Bot started (PID: $BOT_PID)"
+# Webhook mode: the API process hosts every bot on /tg/{bot_id}/webhook,
+# so no separate polling process is needed.
+if [ "${BOT_MODE:-polling}" != "webhook" ]; then
+    # Start the bot supervisor in background (non-blocking). It runs
+    # BOT_WORKERS worker processes (default: one per CPU core), each polling
+    # its shard of the bots, and restarts any worker that dies.
+    python -m bot.supervisor &
+    BOT_PID=$!
 
-# Start API server in FOREGROUND so Render sees port binding
-# This is the main process Render monitors
-exec uvicorn api.main:app --host 0.0.0.0 --port ${PORT:-8000}
+    echo "Bot supervisor started (PID: $BOT_PID)"
+fi
+
+# Start the API server. Not exec'd: this shell stays PID 1 so it can pass
+# SIGTERM / SIGINT (e.g. from a Render deploy) on to both processes, letting
+# the supervisor stop its workers and release bot leases before exit.
+uvicorn api.main:app --host 0.0.0.0 --port ${PORT:-8000} &
+API_PID=$!
+
+shutdown() {
+    trap - TERM INT
+    kill -TERM "$API_PID" 2>/dev/null
+    [ -n "$BOT_PID" ] && kill -TERM "$BOT_PID" 2>/dev/null
+}
+trap shutdown TERM INT
+
+# The API is the main process Render monitors: returns when it exits, or
+# early when a signal is trapped
+wait "$API_PID"
+STATUS=$?
+# The API stopped on its own: take the bots down with it
+[ -n "$BOT_PID" ] && kill -TERM "$BOT_PID" 2>/dev/null
+wait
+exit $STATUS
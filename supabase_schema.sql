@@ -64,3 +64,154 @@ CREATE TABLE IF NOT EXISTS bot_users (
 );
 
 CREATE INDEX IF NOT EXISTS idx_bot_users_bot  ON bot_users (bot_id);
+
+-- Broadcast jobs (one row per /manage broadcast; last_user_id is the resume cursor)
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+  id                 UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  bot_id             TEXT NOT NULL DEFAULT 'default',
+  text               TEXT NOT NULL,
+  status             TEXT NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'done', 'cancelled')),
+  last_user_id       BIGINT,
+  total              INTEGER NOT NULL DEFAULT 0,
+  sent               INTEGER NOT NULL DEFAULT 0,
+  blocked            INTEGER NOT NULL DEFAULT 0,
+  failed             INTEGER NOT NULL DEFAULT 0,
+  status_chat_id     BIGINT,
+  status_message_id  BIGINT,
+  created_at         TIMESTAMPTZ DEFAULT NOW(),
+  updated_at         TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_running ON broadcast_jobs (bot_id) WHERE status = 'running';
+
+-- Keyset scans of payers by (bot_id, user_id) for broadcast recipient streaming
+CREATE INDEX IF NOT EXISTS idx_payments_bot_user ON payments (bot_id, user_id);
+
+-- Keyset pagination of payment listings: ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_payments_bot_created ON payments (bot_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_payments_created     ON payments (created_at DESC, id DESC);
+
+-- Aggregate stats for /manage Stats, broadcast counts and GET /bots/{bot_id}/stats.
+-- p_extra_ids lets callers fold admin IDs into the de-duplicated audience count.
+CREATE INDEX IF NOT EXISTS idx_payments_bot_status ON payments (bot_id, status);
+
+CREATE OR REPLACE FUNCTION bot_stats(p_bot_id TEXT, p_extra_ids BIGINT[] DEFAULT '{}')
+RETURNS JSON
+LANGUAGE sql STABLE
+AS $$
+  SELECT json_build_object(
+    'users',    (SELECT count(*) FROM bot_users WHERE bot_id = p_bot_id),
+    'audience', (SELECT count(*) FROM (
+                   SELECT user_id FROM bot_users WHERE bot_id = p_bot_id
+                   UNION
+                   SELECT user_id FROM payments  WHERE bot_id = p_bot_id
+                   UNION
+                   SELECT unnest(p_extra_ids)
+                 ) a),
+    'payments', COALESCE((SELECT json_object_agg(status, n) FROM (
+                   SELECT status, count(*) AS n FROM payments
+                   WHERE bot_id = p_bot_id GROUP BY status
+                 ) s), '{}'::json)
+  );
+$$;
+
+-- Admin cards sent for each payment: [{"chat_id": .., "message_id": .., "photo": true}]
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS admin_messages JSONB NOT NULL DEFAULT '[]';
+
+-- Bot registry: bots added / paused at runtime (on top of env BOT_TOKEN_<n>).
+-- token NULL = status override for an env-defined bot.
+CREATE TABLE IF NOT EXISTS bots (
+  bot_id      TEXT PRIMARY KEY,
+  token       TEXT,
+  status      TEXT NOT NULL DEFAULT 'active' CHECK (status IN ('active', 'paused')),
+  created_at  TIMESTAMPTZ DEFAULT NOW(),
+  updated_at  TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Polling leases: with LEADER_ELECTION=1 only the replica holding a bot's
+-- lease polls it; others stand by and take over once it expires or is released.
+CREATE TABLE IF NOT EXISTS bot_leases (
+  bot_id      TEXT PRIMARY KEY,
+  holder      TEXT NOT NULL,
+  expires_at  TIMESTAMPTZ NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION acquire_bot_lease(p_bot_id TEXT, p_holder TEXT, p_ttl_seconds DOUBLE PRECISION)
+RETURNS BOOLEAN
+LANGUAGE sql
+AS $$
+  WITH taken AS (
+    INSERT INTO bot_leases (bot_id, holder, expires_at)
+    VALUES (p_bot_id, p_holder, NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (bot_id) DO UPDATE
+      SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+      WHERE bot_leases.holder = EXCLUDED.holder OR bot_leases.expires_at < NOW()
+    RETURNING 1
+  )
+  SELECT EXISTS (SELECT 1 FROM taken);
+$$;
+
+-- Broadcast job ownership: a replica must hold a job's lease to send it, so
+-- a job is never resumed by more than one process. 'failed' = gave up after retries.
+ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS owner       TEXT;
+ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS lease_until TIMESTAMPTZ;
+ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS error       TEXT;
+ALTER TABLE broadcast_jobs DROP CONSTRAINT IF EXISTS broadcast_jobs_status_check;
+ALTER TABLE broadcast_jobs ADD CONSTRAINT broadcast_jobs_status_check
+  CHECK (status IN ('running', 'done', 'cancelled', 'failed'));
+
+CREATE OR REPLACE FUNCTION claim_broadcast_job(p_job_id UUID, p_owner TEXT, p_ttl_seconds DOUBLE PRECISION)
+RETURNS BOOLEAN
+LANGUAGE sql
+AS $$
+  WITH claimed AS (
+    UPDATE broadcast_jobs
+       SET owner = p_owner,
+           lease_until = NOW() + make_interval(secs => p_ttl_seconds)
+     WHERE id = p_job_id
+       AND status = 'running'
+       AND (owner IS NULL OR owner = p_owner OR lease_until IS NULL OR lease_until < NOW())
+    RETURNING 1
+  )
+  SELECT EXISTS (SELECT 1 FROM claimed);
+$$;
+
+-- Per-bot config version, bumped on every bot_config write. Each process polls
+-- this table (bot.db.watch_config_versions) and drops cached config slices whose
+-- version moved, so admin-panel edits reach the bot workers within seconds.
+CREATE TABLE IF NOT EXISTS bot_config_versions (
+  bot_id     TEXT PRIMARY KEY,
+  version    BIGINT NOT NULL DEFAULT 1,
+  updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION bump_bot_config_version()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  b TEXT := CASE WHEN TG_OP = 'DELETE' THEN OLD.bot_id ELSE NEW.bot_id END;
+BEGIN
+  INSERT INTO bot_config_versions (bot_id) VALUES (b)
+  ON CONFLICT (bot_id) DO UPDATE
+    SET version = bot_config_versions.version + 1, updated_at = NOW();
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS bot_config_version ON bot_config;
+CREATE TRIGGER bot_config_version
+  AFTER INSERT OR UPDATE OR DELETE ON bot_config
+  FOR EACH ROW EXECUTE FUNCTION bump_bot_config_version();
+
+-- Conversation states / user_data / chat_data for BOT_STATE_BACKEND=supabase
+-- (bot/persistence.py). kind = conversations | user_data | chat_data; name is the
+-- conversation name ('' otherwise). NULL data = entry removed.
+CREATE TABLE IF NOT EXISTS bot_state (
+  bot_id     TEXT NOT NULL,
+  kind       TEXT NOT NULL,
+  name       TEXT NOT NULL DEFAULT '',
+  key        TEXT NOT NULL,
+  data       TEXT,
+  PRIMARY KEY (bot_id, kind, name, key)
+);